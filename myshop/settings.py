@@ -58,13 +58,13 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.sitemaps',
     'shop.apps.ShopConfig',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
-    'shop.middleware.CartMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.middleware.locale.LocaleMiddleware',
@@ -88,7 +88,6 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
-                'shop.context_processors.cart_context',
             ],
         },
     },
@@ -104,10 +103,57 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Транзакции сразу берут блокировку записи: проверка и списание
+        # остатков при оформлении заказа не пересекаются (см. shop/orders.py)
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
 
+# Кэш. Файловый бэкенд общий для всех WSGI-процессов на одном сервере,
+# через него расходится версия каталога (см. shop/cache.py). Перед ним -
+# LRU в памяти каждого процесса для горячих ключей (shop/tiered_cache.py)
+CACHES = {
+    'default': {
+        'BACKEND': 'shop.tiered_cache.TieredCache',
+        'LOCATION': 'shared',
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+            'LOCAL_TIMEOUT': 5,
+            'VERSION_KEYS': ['shop:catalog_version'],
+            'VERSION_CHECK_INTERVAL': 1,
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('DJANGO_CACHE_DIR', str(BASE_DIR / 'cache')),
+        'TIMEOUT': 60 * 60 * 24,
+    },
+}
+
+# Сессии: маленькие (корзина анонимного покупателя) - в подписанной cookie,
+# остальные - cached_db (shop/sessions.py). Кэш сессий - общий: локальный
+# уровень TieredCache мог бы отдать другому процессу устаревшую корзину
+SESSION_ENGINE = 'shop.sessions'
+SESSION_CACHE_ALIAS = 'shared'
+SHOP_SESSION_COOKIE_MAX_SIZE = 2048
+
+# Сколько секунд страница каталога живет в кэше для анонимов (shop/page_cache.py).
+# Изменения каталога сбрасывают кэш сразу, срок ограничивает только устаревание цен акций и т.п.
+SHOP_PAGE_CACHE_TIMEOUT = 60 * 10
+
+# Сколько секунд товар, добавленный в корзину, отложен для покупателя
+# (shop/reservations.py); истекшие резервы снимает release_reservations
+SHOP_RESERVATION_TTL = 60 * 15
+
+# Сколько секунд пересчет страницы каталога может читать базу, прежде чем
+# посетителю будет отдана последняя удачная копия (shop/page_cache.py)
+SHOP_DB_READ_BUDGET = 2
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
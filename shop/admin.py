@@ -1,8 +1,7 @@
 from django.contrib import admin
 from django.utils.translation import gettext_lazy as _
-from django.db import models
 from .models import Category, Product, ProductImage, ProductReview, Size, ProductSize
-from .models import Order, OrderItem
+from .models import EmailOutbox, Order, OrderItem, StockReservation
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -161,12 +160,6 @@ class ProductAdmin(admin.ModelAdmin):
     def sizes_count(self, obj):
         return obj.product_sizes.count()
     sizes_count.short_description = _('Кол-во размеров')
-    
-    def total_stock(self, obj):
-        """Общее количество товара на складе"""
-        total = obj.product_sizes.aggregate(total=models.Sum('stock_quantity'))['total']
-        return total or 0
-    total_stock.short_description = _('Общий запас')
 
 
 @admin.register(ProductSize)
@@ -295,6 +288,32 @@ class ProductReviewAdmin(admin.ModelAdmin):
         return super().get_queryset(request).select_related('product')
 
 
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    """
+    Очередь исходящих писем (отправляет команда run_mail_worker)
+    """
+    list_display = ['subject', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['subject', 'recipients']
+    readonly_fields = ['subject', 'body', 'from_email', 'recipients', 'attempts',
+                       'last_error', 'created_at', 'sent_at']
+    fields = ['subject', 'from_email', 'recipients', 'body', 'status', 'attempts',
+              'next_attempt_at', 'last_error', 'created_at', 'sent_at']
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    """
+    Товары, отложенные в корзины (истекшие снимает команда release_reservations)
+    """
+    list_display = ['product_size', 'quantity', 'holder', 'expires_at', 'created_at']
+    list_filter = ['expires_at']
+    search_fields = ['holder', 'product_size__product__name']
+    list_select_related = ['product_size__product', 'product_size__size']
+    readonly_fields = ['product_size', 'holder', 'quantity', 'created_at']
+
+
 # УБЕДИТЕСЬ, ЧТО НЕТ ДУБЛИРУЮЩИХ РЕГИСТРАЦИЙ:
 # НЕТ: admin.site.register(Product, ProductAdmin)
 # НЕТ: admin.site.register(Product)
@@ -0,0 +1,117 @@
+"""
+Версия каталога для инвалидации кэшей.
+
+Любое изменение товаров, размеров, изображений или категорий увеличивает
+общий счетчик в кэше Django (``CACHES['default']``) и запоминает время
+изменения (для заголовка Last-Modified). Кэши, ключ которых
+включает версию, после этого просто перестают находиться, а
+внутрипроцессные структуры (например, индекс подсказок поиска)
+перестраиваются при следующем обращении.
+
+``get_or_recompute`` - чтение дорогих значений без «лавины» запросов к
+базе: устаревшее значение (истек срок или сменилась версия каталога)
+пересчитывает один процесс, остальные в это время отдают прежнее.
+"""
+import math
+import random
+import time
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+from django.db import transaction
+
+CATALOG_VERSION_KEY = 'shop:catalog_version'
+CATALOG_CHANGED_AT_KEY = 'shop:catalog_changed_at'
+
+
+def get_catalog_version():
+    """Текущая версия каталога (одинакова во всех процессах)"""
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Начальное значение от времени, чтобы после очистки кэша
+        # версия не совпала с уже использованной
+        cache.add(CATALOG_VERSION_KEY, time.time_ns() // 1000, timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def get_catalog_changed_at():
+    """Время последнего изменения каталога (если неизвестно - текущее)"""
+    changed_at = cache.get(CATALOG_CHANGED_AT_KEY)
+    if changed_at is None:
+        changed_at = time.time()
+        cache.add(CATALOG_CHANGED_AT_KEY, changed_at, timeout=None)
+        changed_at = cache.get(CATALOG_CHANGED_AT_KEY, changed_at)
+    return datetime.fromtimestamp(changed_at, tz=timezone.utc)
+
+
+def bump_catalog_version():
+    """Помечает все кэши каталога устаревшими"""
+    cache.set(CATALOG_CHANGED_AT_KEY, time.time(), timeout=None)
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        return get_catalog_version()
+
+
+def bump_catalog_version_on_commit(using=None):
+    """
+    Версия меняется после фиксации транзакции записи (вне транзакции -
+    сразу). Иначе параллельный рендер прочитает еще старые строки и
+    сохранит их в кэше под новой версией.
+    """
+    transaction.on_commit(bump_catalog_version, using=using)
+
+
+# Сколько хранится устаревшее значение, которое можно отдать во время пересчета
+STALE_TIMEOUT = 60 * 60 * 24
+# Сколько ждать чужого пересчета, если отдать совсем нечего
+LOCK_WAIT = 5
+
+
+def get_or_recompute(key, compute, timeout, version=None, lock_timeout=60, beta=1.0):
+    """
+    Значение ``compute()`` из кэша с защитой от одновременного пересчета.
+
+    Значение хранится вместе с версией (например, версией каталога),
+    сроком свежести ``timeout`` и временем последнего расчета. Устаревшее
+    значение пересчитывает только тот, кто взял блокировку
+    (``cache.add``), остальные отдают старое. Незадолго до истечения
+    срока пересчет с растущей вероятностью начинается заранее
+    (probabilistic early expiration), чтобы свежее значение было готово
+    к моменту истечения.
+
+    Возвращает (значение, версия значения): версия отличается от
+    ``version``, если отдано старое значение, пока его пересчитывают.
+    """
+    entry = cache.get(key)
+    now = time.time()
+    if entry is not None:
+        value, entry_version, expires_at, delta = entry
+        # -log(random()) > 0: чем дороже расчет и ближе срок, тем вероятнее ранний пересчет
+        early = delta * beta * -math.log(1.0 - random.random())
+        if entry_version == version and now + early < expires_at:
+            return value, entry_version
+
+    lock_key = f'{key}:lock'
+    locked = cache.add(lock_key, 1, lock_timeout)
+    if not locked:
+        if entry is not None:
+            return entry[0], entry[1]
+        # Отдать нечего: ждем, пока значение посчитает другой процесс
+        deadline = now + LOCK_WAIT
+        while time.time() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None and entry[1] == version:
+                return entry[0], version
+
+    try:
+        started = time.time()
+        value = compute()
+        delta = time.time() - started
+        cache.set(key, (value, version, time.time() + timeout, delta), timeout + STALE_TIMEOUT)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return value, version
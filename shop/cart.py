@@ -0,0 +1,230 @@
+"""
+Корзина покупателя в сессии.
+
+Формат в сессии (версия 2)::
+
+    {'v': 2, 'h': '9f86d081...', 'total': 350000,
+     'lines': {'17': {'p': 5, 'q': 2, 'u': 175000, 'n': 'Футболка', 's': 'M'}}}
+
+Строки хранятся по id размера товара (он же постоянный id строки в
+адресах), цены - целыми копейками, сумма корзины поддерживается при
+каждом изменении. Поиск, добавление, изменение и удаление строки не
+перебирают корзину и не разбирают строки с ценами. Корзины старого
+формата (список ``items`` с ценами-строками) переводятся в новый при
+чтении. ``h`` - постоянный идентификатор корзины, за которым числятся
+резервы товаров (shop/reservations.py); ключ сессии для этого не
+годится - у сессии в cookie он меняется при каждом сохранении.
+
+Корзина помнит, менялось ли ее содержимое (``modified``), и
+``save_cart`` пишет в сессию только измененную корзину: просмотр
+корзины и повторные запросы без изменений не обновляют строку сессии
+в базе.
+
+Объекты размеров для страницы корзины и для оформления заказа
+загружаются одним запросом ``resolve_lines``.
+"""
+import secrets
+from decimal import ROUND_HALF_UP, Decimal
+
+from .models import ProductSize
+from .reservations import release
+
+CART_SESSION_KEY = 'cart'
+CART_VERSION = 2
+
+
+def to_kopecks(amount):
+    """Сумма в рублях (Decimal, строка) в целых копейках"""
+    return int((Decimal(amount) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def from_kopecks(kopecks):
+    """Целые копейки в Decimal с двумя знаками"""
+    return Decimal(kopecks).scaleb(-2)
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Cart:
+    """Корзина поверх словаря из сессии"""
+
+    def __init__(self, data=None):
+        data = data or {}
+        if data.get('v') != CART_VERSION:
+            data = self._migrate(data)
+        # Копия: изменения попадают в сессию только через save_cart
+        self.lines = {line_id: dict(line) for line_id, line in data['lines'].items()}
+        self.total = data['total']
+        self.holder = data.get('h')
+        self.modified = False
+
+    @staticmethod
+    def _migrate(data):
+        """Корзина версии 1: список строк с id-строками и ценами-строками"""
+        lines = {}
+        for item in data.get('items', []):
+            size_id, product_id = _to_int(item.get('size_id')), _to_int(item.get('product_id'))
+            if size_id is None or product_id is None:
+                continue
+            line = lines.setdefault(str(size_id), {
+                'p': product_id,
+                'q': 0,
+                'u': to_kopecks(item.get('price') or 0),
+                'n': item.get('product_name', ''),
+                's': item.get('size_name', ''),
+            })
+            line['q'] += int(item.get('quantity', 0))
+        return {
+            'lines': lines,
+            'total': sum(line['u'] * line['q'] for line in lines.values()),
+        }
+
+    def to_session(self):
+        data = {'v': CART_VERSION, 'total': self.total, 'lines': self.lines}
+        if self.holder:
+            data['h'] = self.holder
+        return data
+
+    def ensure_holder(self):
+        """Идентификатор корзины для резервов (создается при первом резерве)"""
+        if not self.holder:
+            self.holder = secrets.token_hex(16)
+            self.modified = True
+        return self.holder
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __bool__(self):
+        return bool(self.lines)
+
+    def get(self, line_id):
+        """Строка по id размера или None"""
+        return self.lines.get(str(line_id))
+
+    def add(self, product_size, quantity, product_name='', size_name=''):
+        """Добавляет ``quantity`` штук размера по его текущей цене"""
+        line = self.lines.get(str(product_size.pk))
+        if not quantity:
+            return line
+        if line is None:
+            line = self.lines[str(product_size.pk)] = {
+                'p': product_size.product_id,
+                'q': 0,
+                'u': to_kopecks(product_size.get_final_price()),
+                'n': product_name,
+                's': size_name,
+            }
+        line['q'] += quantity
+        self.total += line['u'] * quantity
+        self.modified = True
+        return line
+
+    def set_quantity(self, line_id, quantity):
+        line = self.lines[str(line_id)]
+        if quantity != line['q']:
+            self.total += line['u'] * (quantity - line['q'])
+            line['q'] = quantity
+            self.modified = True
+        return line
+
+    def remove(self, line_id):
+        """Удаляет строку и возвращает ее (или None, если строки нет)"""
+        line = self.lines.pop(str(line_id), None)
+        if line is not None:
+            self.total -= line['u'] * line['q']
+            self.modified = True
+        return line
+
+    def clear(self):
+        if self.lines:
+            self.lines = {}
+            self.total = 0
+            self.modified = True
+
+    @property
+    def total_amount(self):
+        """Сумма корзины в рублях"""
+        return from_kopecks(self.total)
+
+    def quantities(self):
+        """Количество по id размеров"""
+        return {int(line_id): line['q'] for line_id, line in self.lines.items()}
+
+
+def get_cart(request):
+    """Корзина из сессии (сессия не изменяется)"""
+    return Cart(request.session.get(CART_SESSION_KEY))
+
+
+def save_cart(request, cart):
+    """Сохранение корзины в сессии, если ее содержимое изменилось"""
+    if not cart.modified:
+        return False
+    request.session[CART_SESSION_KEY] = cart.to_session()
+    cart.modified = False
+    return True
+
+
+def serialize_line(line_id, line):
+    """Строка корзины для JSON-ответов"""
+    return {
+        'line_id': int(line_id),
+        'product_id': line['p'],
+        'name': line.get('n', ''),
+        'size': line.get('s', ''),
+        'quantity': line['q'],
+        'price': str(from_kopecks(line['u'])),
+        'total_price': str(from_kopecks(line['u'] * line['q'])),
+    }
+
+
+def serialize_cart(cart):
+    """Состояние корзины для скриптов страницы (без запросов к базе)"""
+    return {
+        'items': [serialize_line(line_id, line) for line_id, line in cart.lines.items()],
+        'count': len(cart),
+        'total': str(cart.total_amount),
+    }
+
+
+def resolve_lines(cart):
+    """
+    Строки корзины с загруженными размерами товаров.
+
+    Все размеры выбираются одним запросом вместе с товаром и размером.
+    Строки, для которых размер удален или принадлежит другому товару,
+    удаляются из ``cart`` вместе с их резервами. Возвращает (строки,
+    были ли удалены строки).
+    """
+    sizes = ProductSize.objects.select_related('product', 'size').in_bulk(
+        [int(line_id) for line_id in cart.lines]
+    )
+
+    lines, missing = [], []
+    for line_id, line in cart.lines.items():
+        product_size = sizes.get(int(line_id))
+        if product_size is None or product_size.product_id != line['p']:
+            missing.append(line_id)
+            continue
+        price = from_kopecks(line['u'])
+        product = product_size.product
+        lines.append({
+            'line_id': product_size.pk,
+            'product': product,
+            'product_size': product_size,
+            'quantity': line['q'],
+            'price': price,
+            'total_price': from_kopecks(line['u'] * line['q']),
+            'image_url': product.image.url if product.image else '',
+        })
+
+    for line_id in missing:
+        cart.remove(line_id)
+        release(cart.holder, int(line_id))
+    return lines, bool(missing)
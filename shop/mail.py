@@ -0,0 +1,129 @@
+"""
+Очередь исходящих писем.
+
+Представления не ждут SMTP-сервер: ``enqueue_mail`` только сохраняет
+письмо в таблицу ``EmailOutbox`` (в текущей транзакции, если она есть).
+Команда ``run_mail_worker`` забирает письма пачками и отправляет их
+через одно SMTP-соединение. Неудачная отправка повторяется с
+экспоненциально растущей паузой, после ``MAX_ATTEMPTS`` попыток письмо
+помечается как неотправленное.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EmailOutbox
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 8
+RETRY_BASE_DELAY = timedelta(seconds=30)
+RETRY_MAX_DELAY = timedelta(hours=6)
+# Сколько письмо считается занятым воркером, который его забрал
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+
+def enqueue_mail(subject, message, recipient_list, from_email=None):
+    """Ставит письмо в очередь; аналог ``send_mail`` без обращения к SMTP"""
+    return EmailOutbox.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        recipients=list(recipient_list),
+    )
+
+
+def retry_delay(attempts):
+    """Пауза перед следующей попыткой: 30 с, 1 мин, 2 мин, ... не больше 6 ч"""
+    return min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+
+
+def claim_batch(batch_size=BATCH_SIZE):
+    """
+    Забирает пачку писем, срок отправки которых наступил.
+
+    Письма откладываются на ``CLAIM_TIMEOUT`` короткой транзакцией, и
+    отправка идет уже без блокировок. Если воркер упадет, письма
+    вернутся в очередь по истечении этого срока.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        EmailOutbox.objects.filter(pk__in=ids).update(next_attempt_at=now + CLAIM_TIMEOUT)
+    return list(EmailOutbox.objects.filter(pk__in=ids).order_by('pk'))
+
+
+def record_failure(outbox, error):
+    """Засчитывает неудачную попытку: письмо откладывается или помечается неотправленным"""
+    outbox.attempts += 1
+    outbox.last_error = f'{type(error).__name__}: {error}'
+    if outbox.attempts >= MAX_ATTEMPTS:
+        outbox.status = 'failed'
+    else:
+        outbox.next_attempt_at = timezone.now() + retry_delay(outbox.attempts)
+    outbox.save(update_fields=['status', 'attempts', 'next_attempt_at', 'last_error'])
+
+
+def deliver(messages, connection):
+    """Отправляет письма через открытое соединение и записывает результат"""
+    sent = 0
+    for outbox in messages:
+        email = EmailMessage(
+            outbox.subject,
+            outbox.body,
+            outbox.from_email,
+            outbox.recipients,
+            connection=connection,
+        )
+        try:
+            email.send(fail_silently=False)
+        except Exception as e:
+            record_failure(outbox, e)
+            continue
+        outbox.attempts += 1
+        outbox.status = 'sent'
+        outbox.sent_at = timezone.now()
+        outbox.last_error = ''
+        outbox.save(update_fields=['status', 'attempts', 'last_error', 'sent_at'])
+        sent += 1
+    return sent
+
+
+def drain(batch_size=BATCH_SIZE, connection=None):
+    """
+    Отправляет все письма, срок которых наступил, через одно соединение.
+    Возвращает (отправлено, всего обработано). Если соединение не
+    открылось, ошибка записывается в письма пачки и пробрасывается.
+    """
+    sent = processed = 0
+    connection = connection or get_connection()
+    opened = False
+    try:
+        while True:
+            batch = claim_batch(batch_size)
+            if not batch:
+                break
+            if not opened:
+                # Соединение открывается только если есть что отправлять
+                try:
+                    connection.open()
+                except Exception as e:
+                    # Попытка засчитывается всей пачке: при недоступном SMTP
+                    # письма дойдут до MAX_ATTEMPTS, а не будут ждать вечно
+                    for outbox in batch:
+                        record_failure(outbox, e)
+                    raise
+                opened = True
+            sent += deliver(batch, connection)
+            processed += len(batch)
+    finally:
+        if opened:
+            connection.close()
+    return sent, processed
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shop.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Полностью перестраивает поисковый индекс товаров'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        count = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Поисковый индекс ({type(backend).__name__}) перестроен: {count} товаров'
+        ))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сводку наличия и цен (has_stock, min/max цена, запас) для всех товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Количество товаров, пересчитываемых одним запросом',
+        )
+
+    def handle(self, *args, **options):
+        products = Product.objects.all()
+        products.refresh_stock_summary(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Сводка наличия пересчитана для {products.count()} товаров'
+        ))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = (
+        'Снимает истекшие резервы товаров в корзинах (StockReservation), '
+        'возвращая товар в продажу'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=60,
+            help='Пауза в секундах между проверками',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Снять истекшие резервы один раз и завершиться (для cron)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired()
+            if released:
+                self.stdout.write(f'Снято резервов: {released}')
+            if options['once']:
+                break
+            time.sleep(options['interval'])
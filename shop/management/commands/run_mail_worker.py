@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.mail import BATCH_SIZE, drain
+
+
+class Command(BaseCommand):
+    help = (
+        'Отправляет письма из очереди EmailOutbox пачками через одно '
+        'SMTP-соединение, повторяя неудачные попытки с нарастающей паузой'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Сколько писем забирать из очереди за раз',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=10,
+            help='Пауза в секундах между проверками пустой очереди',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Отправить то, что есть в очереди, и завершиться (для cron)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                sent, processed = drain(options['batch_size'])
+            except Exception as e:
+                # Например, SMTP-сервер недоступен: письма повторятся после паузы
+                self.stderr.write(f'Ошибка отправки писем: {e}')
+                sent = processed = 0
+            if processed:
+                self.stdout.write(f'Отправлено писем: {sent} из {processed}')
+            if options['once']:
+                break
+            time.sleep(options['interval'])
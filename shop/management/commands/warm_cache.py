@@ -0,0 +1,165 @@
+import re
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.error import HTTPError
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.urls import Resolver404, resolve
+
+from shop.page_cache import CACHED_QUERY_PARAMS
+from shop.urls import sitemaps
+
+# Строка access-лога в формате combined (nginx, PythonAnywhere)
+LOG_REQUEST_RE = re.compile(r'"GET (?P<url>\S+) HTTP/[\d.]+" (?P<status>\d{3}) ')
+
+USER_AGENT = 'neboley-warm-cache'
+
+
+def is_page_cached(path):
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return False
+    return getattr(match.func, 'page_cached', False)
+
+
+def normalize_url(url):
+    """Путь и только те параметры, от которых зависит ключ кэша страницы"""
+    parts = urlsplit(url)
+    params = sorted(
+        (name, value) for name, value in parse_qsl(parts.query)
+        if name in CACHED_QUERY_PARAMS and value
+    )
+    return f'{parts.path}?{urlencode(params)}' if params else parts.path
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогревает кэш страниц и фрагментов: самые частые адреса каталога '
+        'из access-лога, затем все адреса из sitemap'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--base-url',
+            default=getattr(settings, 'SITE_URL', 'http://localhost'),
+            help=(
+                'Адрес сайта, которому отправляются запросы: схема и хост '
+                'входят в ключ кэша страниц (по умолчанию SITE_URL)'
+            ),
+        )
+        parser.add_argument(
+            '--access-log',
+            help='Access-лог веб-сервера, из которого берутся частые фильтры и сортировки',
+        )
+        parser.add_argument(
+            '--log-lines',
+            type=int,
+            default=100000,
+            help='Сколько последних строк лога учитывать',
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=100,
+            help='Сколько самых частых адресов из лога прогревать',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=2,
+            help='Число одновременных запросов (не больше, чем можно отнять у живого трафика)',
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=30,
+            help='Сколько секунд ждать ответа на один запрос',
+        )
+        parser.add_argument(
+            '--time-budget',
+            type=float,
+            default=120,
+            help='Не начинать новые страницы через N секунд после старта',
+        )
+
+    def urls_from_log(self, path, lines, top):
+        counts = Counter()
+        with open(path, encoding='utf-8', errors='replace') as log:
+            for line in deque(log, maxlen=lines):
+                match = LOG_REQUEST_RE.search(line)
+                if not match or match['status'] != '200':
+                    continue
+                url = normalize_url(match['url'])
+                if is_page_cached(urlsplit(url).path):
+                    counts[url] += 1
+        return [url for url, _ in counts.most_common(top)]
+
+    def urls_from_sitemaps(self):
+        for sitemap_class in sitemaps.values():
+            sitemap = sitemap_class()
+            for item in sitemap.items():
+                url = sitemap.location(item)
+                if is_page_cached(urlsplit(url).path):
+                    yield url
+
+    def warm(self, url, base_url, timeout):
+        """
+        Обычный HTTP-запрос к сайту: страница рендерится тем же процессом,
+        что обслуживает посетителей, и попадает в его кэш
+        """
+        request = Request(urljoin(base_url, url), headers={'User-Agent': USER_AGENT})
+        try:
+            with urlopen(request, timeout=timeout) as response:
+                response.read()
+                return response.status
+        except HTTPError as e:
+            return e.code
+
+    def handle(self, *args, **options):
+        deadline = time.monotonic() + options['time_budget']
+
+        urls = []
+        if options['access_log']:
+            urls.extend(self.urls_from_log(options['access_log'], options['log_lines'], options['top']))
+        urls.extend(self.urls_from_sitemaps())
+        urls = list(dict.fromkeys(urls))
+
+        workers = max(options['concurrency'], 1)
+        warmed, failed = 0, []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            queue = iter(urls)
+            while True:
+                # Новые страницы ставятся, пока не вышло время и есть свободный поток
+                while len(pending) < workers and time.monotonic() < deadline:
+                    url = next(queue, None)
+                    if url is None:
+                        break
+                    future = executor.submit(self.warm, url, options['base_url'], options['timeout'])
+                    future.url = url
+                    pending.add(future)
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        status = future.result()
+                    except Exception as e:
+                        status = e
+                    if status == 200:
+                        warmed += 1
+                    else:
+                        failed.append((future.url, status))
+
+        for url, status in failed:
+            self.stderr.write(f'{url}: {status}')
+        skipped = len(urls) - warmed - len(failed)
+        self.stdout.write(self.style.SUCCESS(
+            f'Прогрето страниц: {warmed}, с ошибками: {len(failed)}, '
+            f'пропущено по времени: {skipped}'
+        ))
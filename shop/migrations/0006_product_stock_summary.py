@@ -0,0 +1,76 @@
+# Generated by Django 5.2.6 on 2026-10-17 03:15
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_stock_summary(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    ProductSize = apps.get_model('shop', 'ProductSize')
+
+    in_stock = Q(in_stock=True)
+    effective_price = Coalesce('price', 'product__price')
+    summary = {
+        row['product_id']: row
+        for row in ProductSize.objects.values('product_id').annotate(
+            available=Count('pk', filter=in_stock),
+            total=Sum('stock_quantity'),
+            low=Min(effective_price, filter=in_stock),
+            high=Max(effective_price, filter=in_stock),
+        ).order_by()
+    }
+
+    products = list(Product.objects.only('pk', 'price'))
+    for product in products:
+        row = summary.get(product.pk, {})
+        product.available_sizes_count = row.get('available') or 0
+        product.has_stock = product.available_sizes_count > 0
+        product.total_stock = row.get('total') or 0
+        product.min_price = row.get('low') or product.price
+        product.max_price = row.get('high') or product.price
+    Product.objects.bulk_update(
+        products,
+        ['has_stock', 'min_price', 'max_price', 'total_stock', 'available_sizes_count'],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='available_sizes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Размеров в наличии'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='has_stock',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Есть в наличии'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='max_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True, verbose_name='Максимальная цена (руб.)'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='min_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True, verbose_name='Минимальная цена (руб.)'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='total_stock',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Общий запас'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', 'has_stock'], name='shop_product_active_stock_idx'),
+        ),
+        migrations.RunPython(fill_stock_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,148 @@
+import re
+
+from django.db import migrations
+
+# Копия стеммера из shop/search/stemmer.py на момент миграции: миграция не
+# должна зависеть от кода приложения, который может измениться позже
+
+VOWELS = 'аеиоуыэюя'
+
+PERFECTIVE_GERUND = re.compile(r'(ив|ивши|ившись|ыв|ывши|ывшись|(?<=[ая])(в|вши|вшись))$')
+REFLEXIVE = re.compile(r'(ся|сь)$')
+ADJECTIVE = re.compile(
+    r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$'
+)
+PARTICIPLE = re.compile(r'(ивш|ывш|ующ|(?<=[ая])(ем|нн|вш|ющ|щ))$')
+VERB = re.compile(
+    r'(ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|'
+    r'ены|ить|ыть|ишь|ую|ю|(?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно))$'
+)
+NOUN = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|'
+    r'ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+SUPERLATIVE = re.compile(r'(ейш|ейше)$')
+DERIVATIONAL = re.compile(r'(ост|ость)$')
+
+WORD_RE = re.compile(r'\w+')
+CYRILLIC_RE = re.compile(r'[а-я]')
+
+
+def _region(word, start=0):
+    for i in range(start + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            return i + 1
+    return len(word)
+
+
+def _strip(pattern, word, rv, min_start=None):
+    match = pattern.search(word[rv:])
+    if not match:
+        return word, False
+    start = rv + match.start()
+    if min_start is not None and start < min_start:
+        return word, False
+    return word[:start], True
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    if not CYRILLIC_RE.search(word):
+        return word
+
+    rv = next((i + 1 for i, ch in enumerate(word) if ch in VOWELS), len(word))
+    r2 = _region(word, _region(word))
+
+    word, found = _strip(PERFECTIVE_GERUND, word, rv)
+    if not found:
+        word, _ = _strip(REFLEXIVE, word, rv)
+        word, found = _strip(ADJECTIVE, word, rv)
+        if found:
+            word, _ = _strip(PARTICIPLE, word, rv)
+        else:
+            word, found = _strip(VERB, word, rv)
+            if not found:
+                word, _ = _strip(NOUN, word, rv)
+
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    word, _ = _strip(DERIVATIONAL, word, rv, min_start=r2)
+
+    if word.endswith('нн') and len(word) - 2 >= rv:
+        word = word[:-1]
+    else:
+        word, found = _strip(SUPERLATIVE, word, rv)
+        if found and word.endswith('нн'):
+            word = word[:-1]
+        elif word.endswith('ь') and len(word) - 1 >= rv:
+            word = word[:-1]
+    return word
+
+
+def tokenize(text):
+    return [stem(token) for token in WORD_RE.findall(text or '')]
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    Product = apps.get_model('shop', 'Product')
+    rows = Product.objects.values_list('pk', 'name', 'description', 'category__name')
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            if not cursor.fetchone()[0]:
+                return
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts "
+                "USING fts5(name, description, category, "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+            cursor.executemany(
+                'INSERT INTO shop_product_fts (rowid, name, description, category) VALUES (%s, %s, %s, %s)',
+                [
+                    (pk, ' '.join(tokenize(name)), ' '.join(tokenize(description)),
+                     ' '.join(tokenize(category)))
+                    for pk, name, description, category in rows
+                ],
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                'CREATE TABLE IF NOT EXISTS shop_product_search ('
+                'product_id bigint PRIMARY KEY REFERENCES shop_product(id) ON DELETE CASCADE, '
+                'document tsvector NOT NULL)'
+            )
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS shop_product_search_document_idx '
+                'ON shop_product_search USING GIN (document)'
+            )
+            cursor.execute(
+                "INSERT INTO shop_product_search (product_id, document) "
+                "SELECT p.id, "
+                "setweight(to_tsvector('russian', p.name), 'A') || "
+                "setweight(to_tsvector('russian', c.name), 'B') || "
+                "setweight(to_tsvector('russian', coalesce(p.description, '')), 'C') "
+                "FROM shop_product p JOIN shop_category c ON c.id = p.category_id "
+                "ON CONFLICT (product_id) DO NOTHING"
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('DROP TABLE IF EXISTS shop_product_fts')
+        elif connection.vendor == 'postgresql':
+            cursor.execute('DROP TABLE IF EXISTS shop_product_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_product_popularity'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
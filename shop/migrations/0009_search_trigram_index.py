@@ -0,0 +1,77 @@
+import re
+
+from django.db import migrations
+
+# Копия shop/search/trigrams.py на момент миграции
+WORD_RE = re.compile(r'\w+')
+MAX_WORD_LENGTH = 30
+
+
+def text_trigrams(text):
+    """Список (номер слова, множество триграмм) для индексации"""
+    result = []
+    for number, word in enumerate(WORD_RE.findall((text or '').lower().replace('ё', 'е'))):
+        padded = f'  {word[:MAX_WORD_LENGTH]} '
+        result.append((number, {padded[i:i + 3] for i in range(len(padded) - 2)}))
+    return result
+
+
+def create_trigram_index(apps, schema_editor):
+    connection = schema_editor.connection
+    Product = apps.get_model('shop', 'Product')
+    Category = apps.get_model('shop', 'Category')
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                'CREATE TABLE IF NOT EXISTS shop_search_trigram ('
+                'trigram TEXT NOT NULL, kind TEXT NOT NULL, object_id INTEGER NOT NULL, '
+                'word_no INTEGER NOT NULL, total INTEGER NOT NULL, '
+                'PRIMARY KEY (trigram, kind, object_id, word_no)) WITHOUT ROWID'
+            )
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS shop_search_trigram_object_idx '
+                'ON shop_search_trigram (kind, object_id)'
+            )
+            for kind, model in (('p', Product), ('c', Category)):
+                cursor.executemany(
+                    'INSERT OR IGNORE INTO shop_search_trigram '
+                    '(trigram, kind, object_id, word_no, total) VALUES (%s, %s, %s, %s, %s)',
+                    [
+                        (trigram, kind, pk, number, len(trigrams))
+                        for pk, name in model.objects.values_list('pk', 'name')
+                        for number, trigrams in text_trigrams(name)
+                        for trigram in trigrams
+                    ],
+                )
+        elif connection.vendor == 'postgresql':
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS shop_product_name_trgm_idx '
+                'ON shop_product USING GIN (name gin_trgm_ops)'
+            )
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS shop_category_name_trgm_idx '
+                'ON shop_category USING GIN (name gin_trgm_ops)'
+            )
+
+
+def drop_trigram_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('DROP TABLE IF EXISTS shop_search_trigram')
+        elif connection.vendor == 'postgresql':
+            cursor.execute('DROP INDEX IF EXISTS shop_product_name_trgm_idx')
+            cursor.execute('DROP INDEX IF EXISTS shop_category_name_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_product_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
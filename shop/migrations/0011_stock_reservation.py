@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-17 03:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_email_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('holder', models.CharField(help_text='Идентификатор корзины покупателя', max_length=32, verbose_name='Корзина')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Количество')),
+                ('expires_at', models.DateTimeField(verbose_name='Действует до')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('product_size', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='shop.productsize', verbose_name='Размер товара')),
+            ],
+            options={
+                'verbose_name': 'Резерв товара',
+                'verbose_name_plural': 'Резервы товаров',
+                'indexes': [models.Index(fields=['product_size', 'expires_at'], name='shop_reservation_active_idx'), models.Index(fields=['expires_at'], name='shop_reservation_expiry_idx')],
+                'constraints': [models.UniqueConstraint(fields=('holder', 'product_size'), name='shop_reservation_holder_uniq')],
+            },
+        ),
+    ]
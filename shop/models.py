@@ -1,10 +1,14 @@
 from django.db import models
+from django.db.models import Count, Min, Max, Q, Sum
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator
 from decimal import Decimal
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 import pytz
 
+from .querycache import CachedQuerySet
+
 
 class Size(models.Model):
     """
@@ -31,6 +35,8 @@ class Size(models.Model):
         ('54', '54'),
     ]
 
+    SIZE_NAMES = dict(SIZE_CHOICES)
+
     code = models.CharField(
         max_length=10,
         choices=SIZE_CHOICES,
@@ -50,6 +56,8 @@ class Size(models.Model):
         help_text=_('Описание размера (необязательно)')
     )
 
+    objects = CachedQuerySet.as_manager()
+
     class Meta:
         verbose_name = _('Размер')
         verbose_name_plural = _('Размеры')
@@ -60,11 +68,8 @@ class Size(models.Model):
 
     def save(self, *args, **kwargs):
         """Автоматически заполняем name из выбранного code"""
-        if not self.name:
-            for code, name in self.SIZE_CHOICES:
-                if code == self.code:
-                    self.name = name
-                    break
+        if not self.name and self.code in self.SIZE_NAMES:
+            self.name = self.SIZE_NAMES[self.code]
         super().save(*args, **kwargs)
 
 
@@ -120,6 +125,8 @@ class Category(models.Model):
         verbose_name=_('Дата обновления')
     )
 
+    objects = CachedQuerySet.as_manager()
+
     class Meta:
         verbose_name = _('Категория')
         verbose_name_plural = _('Категории')
@@ -136,10 +143,103 @@ class Category(models.Model):
         return f'/catalog/{self.slug}/'
 
 
+class ProductQuerySet(CachedQuerySet):
+    """
+    QuerySet товаров с поддержкой денормализованной сводки наличия
+    """
+
+    SEARCH_FIELDS = {'name', 'description', 'category', 'category_id'}
+
+    # Поля, изменение которых не меняет страницы каталога
+    NON_RENDERED_FIELDS = {'popularity', 'updated_at'}
+
+    # Поля, которые карточки товара в списках не показывают
+    CARD_DEFERRED_FIELDS = ['description', 'category__description', 'category__image']
+
+    def storefront(self, in_stock=True):
+        """
+        Товары для витрины: активные (и по умолчанию - в наличии), с
+        категорией одним JOIN и без тяжелых полей, не нужных карточкам.
+        Число запросов страницы не зависит от количества карточек.
+        """
+        queryset = self.filter(is_active=True)
+        if in_stock:
+            queryset = queryset.filter(has_stock=True)
+        return queryset.select_related('category').defer(*self.CARD_DEFERRED_FIELDS)
+
+    def update(self, **kwargs):
+        """
+        Массовое изменение базовой цены пересчитывает сводку цен,
+        изменение названия, описания или категории - поисковый индекс.
+        Версия каталога не меняется, если обновляется только популярность;
+        иначе у товаров меняется ``updated_at`` (по нему кэшируются карточки).
+        """
+        from .cache import bump_catalog_version_on_commit
+
+        rendered = not self.NON_RENDERED_FIELDS.issuperset(kwargs)
+        if rendered:
+            kwargs.setdefault('updated_at', timezone.now())
+        refresh_summary = 'price' in kwargs
+        reindex = not self.SEARCH_FIELDS.isdisjoint(kwargs)
+        if refresh_summary or reindex:
+            product_ids = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        if refresh_summary:
+            self.model.objects.filter(pk__in=product_ids).refresh_stock_summary()
+        if reindex:
+            from .search import get_search_backend
+            get_search_backend().index_products(product_ids)
+        if rendered:
+            bump_catalog_version_on_commit(self.db)
+        return rows
+
+    def refresh_stock_summary(self, batch_size=500):
+        """
+        Пересчитывает сводку наличия и цен (has_stock, min/max цена,
+        общий запас, число размеров в наличии) для товаров выборки.
+        Один агрегирующий запрос и один bulk_update на пачку товаров;
+        записываются только товары, у которых сводка изменилась, и у них
+        обновляется ``updated_at``.
+        """
+        fields = Product.STOCK_SUMMARY_FIELDS
+        products = list(self.order_by().only('pk', 'price', *fields))
+        for start in range(0, len(products), batch_size):
+            batch = {p.pk: p for p in products[start:start + batch_size]}
+            in_stock = Q(in_stock=True)
+            effective_price = Coalesce('price', 'product__price')
+            rows = ProductSize.objects.filter(product_id__in=list(batch)).values('product_id').annotate(
+                available=Count('pk', filter=in_stock),
+                total=Sum('stock_quantity'),
+                low=Min(effective_price, filter=in_stock),
+                high=Max(effective_price, filter=in_stock),
+            ).order_by()
+            summary = {row['product_id']: row for row in rows}
+
+            now = timezone.now()
+            changed = []
+            for product_id, product in batch.items():
+                before = [getattr(product, field) for field in fields]
+                row = summary.get(product_id, {})
+                product.available_sizes_count = row.get('available') or 0
+                product.has_stock = product.available_sizes_count > 0
+                product.total_stock = row.get('total') or 0
+                product.min_price = row.get('low') or product.price
+                product.max_price = row.get('high') or product.price
+                if [getattr(product, field) for field in fields] != before:
+                    product.updated_at = now
+                    changed.append(product)
+            if changed:
+                self.model.objects.bulk_update(changed, [*fields, 'updated_at'])
+
+
 class Product(models.Model):
     """
     Модель товара
     """
+    STOCK_SUMMARY_FIELDS = [
+        'has_stock', 'min_price', 'max_price', 'total_stock', 'available_sizes_count',
+    ]
+
     name = models.CharField(
         max_length=200,
         verbose_name=_('Название товара'),
@@ -206,6 +306,48 @@ class Product(models.Model):
         verbose_name=_('Дата обновления')
     )
 
+    # Денормализованная сводка по размерам (обновляется сигналами, см. signals.py)
+    has_stock = models.BooleanField(
+        default=False,
+        editable=False,
+        verbose_name=_('Есть в наличии')
+    )
+    min_price = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        editable=False,
+        verbose_name=_('Минимальная цена (руб.)')
+    )
+    max_price = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        editable=False,
+        verbose_name=_('Максимальная цена (руб.)')
+    )
+    total_stock = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name=_('Общий запас')
+    )
+    available_sizes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name=_('Размеров в наличии')
+    )
+
+    # Популярность по продажам с затуханием (см. команду update_popularity)
+    popularity = models.FloatField(
+        default=0,
+        editable=False,
+        verbose_name=_('Популярность')
+    )
+
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         verbose_name = _('Товар')
         verbose_name_plural = _('Товары')
@@ -216,6 +358,12 @@ class Product(models.Model):
             models.Index(fields=['category']),
             models.Index(fields=['price']),
             models.Index(fields=['created_at']),
+            # Составные индексы для курсорной пагинации (ключ сортировки + id)
+            models.Index(fields=['name', 'id'], name='shop_product_name_id_idx'),
+            models.Index(fields=['price', 'id'], name='shop_product_price_id_idx'),
+            models.Index(fields=['created_at', 'id'], name='shop_product_created_id_idx'),
+            models.Index(fields=['is_active', 'has_stock'], name='shop_product_active_stock_idx'),
+            models.Index(fields=['popularity', 'id'], name='shop_product_popularity_idx'),
         ]
 
     def __str__(self):
@@ -254,6 +402,38 @@ class Product(models.Model):
         return self.sizes.count() > 1
 
 
+class ProductSizeQuerySet(CachedQuerySet):
+    """
+    QuerySet размеров товара: массовые операции обновляют сводку товаров
+    """
+
+    NON_RENDERED_FIELDS = {'updated_at'}
+
+    def _refresh_products(self, product_ids, fields=None):
+        from .cache import bump_catalog_version_on_commit
+
+        Product.objects.filter(pk__in=set(product_ids)).refresh_stock_summary()
+        if fields is None or not self.NON_RENDERED_FIELDS.issuperset(fields):
+            bump_catalog_version_on_commit(self.db)
+
+    def update(self, **kwargs):
+        product_ids = list(self.values_list('product_id', flat=True).distinct())
+        rows = super().update(**kwargs)
+        self._refresh_products(product_ids, kwargs)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        self._refresh_products(obj.product_id for obj in objs)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        self._refresh_products((obj.product_id for obj in objs), fields)
+        return rows
+
+
 class ProductSize(models.Model):
     """
     Модель связи товара и размера с наличием и ценой
@@ -314,6 +494,8 @@ class ProductSize(models.Model):
         verbose_name=_('Дата обновления')
     )
 
+    objects = ProductSizeQuerySet.as_manager()
+
     class Meta:
         verbose_name = _('Размер товара')
         verbose_name_plural = _('Размеры товаров')
@@ -375,6 +557,8 @@ class ProductImage(models.Model):
         verbose_name=_('Дата создания')
     )
 
+    objects = CachedQuerySet.as_manager()
+
     class Meta:
         verbose_name = _('Изображение товара')
         verbose_name_plural = _('Изображения товаров')
@@ -425,6 +609,8 @@ class ProductReview(models.Model):
         verbose_name=_('Дата создания')
     )
 
+    objects = CachedQuerySet.as_manager()
+
     class Meta:
         verbose_name = _('Отзыв')
         verbose_name_plural = _('Отзывы')
@@ -594,4 +780,116 @@ class OrderItem(models.Model):
     def total_price(self):
         return self.price * self.quantity
     
-    
\ No newline at end of file
+    
+
+class EmailOutbox(models.Model):
+    """
+    Письмо в очереди на отправку.
+
+    Письма сохраняются в той же транзакции, что и заказ, и отправляются
+    командой ``run_mail_worker`` (см. shop/mail.py).
+    """
+    STATUS_CHOICES = [
+        ('pending', _('Ожидает отправки')),
+        ('sent', _('Отправлено')),
+        ('failed', _('Не отправлено')),
+    ]
+
+    subject = models.CharField(
+        max_length=255,
+        verbose_name=_('Тема')
+    )
+    body = models.TextField(
+        verbose_name=_('Текст')
+    )
+    from_email = models.CharField(
+        max_length=255,
+        verbose_name=_('Отправитель')
+    )
+    recipients = models.JSONField(
+        default=list,
+        verbose_name=_('Получатели')
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default='pending',
+        verbose_name=_('Статус')
+    )
+    attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_('Попыток отправки')
+    )
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name=_('Следующая попытка')
+    )
+    last_error = models.TextField(
+        blank=True,
+        verbose_name=_('Последняя ошибка')
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name=_('Дата создания')
+    )
+    sent_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name=_('Дата отправки')
+    )
+
+    class Meta:
+        verbose_name = _('Письмо в очереди')
+        verbose_name_plural = _('Очередь писем')
+        ordering = ['-created_at']
+        indexes = [
+            # Выборка очередной пачки воркером
+            models.Index(fields=['status', 'next_attempt_at'], name='shop_outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} → {', '.join(self.recipients)}"
+
+
+class StockReservation(models.Model):
+    """
+    Товар, отложенный в корзину: на время ``expires_at`` он не продается
+    другим покупателям (см. shop/reservations.py).
+    """
+    product_size = models.ForeignKey(
+        ProductSize,
+        on_delete=models.CASCADE,
+        related_name='reservations',
+        verbose_name=_('Размер товара')
+    )
+    holder = models.CharField(
+        max_length=32,
+        verbose_name=_('Корзина'),
+        help_text=_('Идентификатор корзины покупателя')
+    )
+    quantity = models.PositiveIntegerField(
+        verbose_name=_('Количество')
+    )
+    expires_at = models.DateTimeField(
+        verbose_name=_('Действует до')
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name=_('Дата создания')
+    )
+
+    class Meta:
+        verbose_name = _('Резерв товара')
+        verbose_name_plural = _('Резервы товаров')
+        constraints = [
+            models.UniqueConstraint(fields=['holder', 'product_size'], name='shop_reservation_holder_uniq'),
+        ]
+        indexes = [
+            # Сумма действующих резервов размера - один запрос по индексу
+            models.Index(fields=['product_size', 'expires_at'], name='shop_reservation_active_idx'),
+            # Удаление истекших резервов командой release_reservations
+            models.Index(fields=['expires_at'], name='shop_reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_size} × {self.quantity} до {self.expires_at:%d.%m.%Y %H:%M}"
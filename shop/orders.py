@@ -0,0 +1,102 @@
+"""
+Оформление заказа.
+
+Заказ, его товары и списание остатков выполняются в одной транзакции.
+Строки размеров блокируются до проверки остатков: на PostgreSQL через
+``SELECT ... FOR UPDATE``, на SQLite транзакция сразу берет блокировку
+записи (``BEGIN IMMEDIATE``, см. ``transaction_mode`` в настройках).
+Поэтому два покупателя не могут купить последний экземпляр одновременно.
+"""
+from collections import Counter
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+
+from .models import OrderItem, Product, ProductSize
+from .reservations import release, reserved_quantities
+
+
+class OrderError(Exception):
+    """Заказ нельзя оформить: товар закончился или корзина пуста"""
+
+
+def place_order(order, cart):
+    """
+    Сохраняет ``order`` (несохраненный экземпляр из формы) с товарами из
+    корзины (``shop.cart.Cart``) и списывает остатки.
+
+    Цены и сумма заказа берутся из базы, а не из сессии. Товар, отложенный
+    в чужие корзины, не продается; резервы этой корзины снимаются. Если
+    какого-то размера нет или его не хватает, вызывает ``OrderError``, и
+    ничего не сохраняется.
+    """
+    quantities = cart.quantities()
+    if not quantities:
+        raise OrderError('Корзина пуста')
+
+    with transaction.atomic():
+        # Блокируем строки в порядке id, чтобы параллельные заказы не ждали друг друга по кругу
+        sizes = {
+            product_size.pk: product_size
+            for product_size in ProductSize.objects.select_for_update(of=('self',))
+            .select_related('product', 'size')
+            .filter(pk__in=quantities)
+            .order_by('pk')
+        }
+
+        reserved = reserved_quantities(list(quantities), exclude_holder=cart.holder)
+
+        items, total = [], Decimal('0.00')
+        for size_id, quantity in quantities.items():
+            product_size = sizes.get(size_id)
+            if product_size is None:
+                raise OrderError('Товар из корзины больше не продается')
+            available = product_size.stock_quantity - reserved.get(size_id, 0)
+            if not product_size.in_stock or available < quantity:
+                raise OrderError(
+                    f'Недостаточно товара «{product_size.product.name}» '
+                    f'({product_size.size.name}) на складе'
+                )
+            price = product_size.get_final_price()
+            total += price * quantity
+            items.append(OrderItem(
+                order=order,
+                product=product_size.product,
+                product_size=product_size,
+                quantity=quantity,
+                price=price,
+            ))
+
+        order.total_amount = total
+        order.save()
+        OrderItem.objects.bulk_create(items)
+
+        # Остатки и признак наличия - одним UPDATE по заблокированным строкам
+        ProductSize.objects.filter(pk__in=quantities).update(
+            stock_quantity=F('stock_quantity') - Case(
+                *[When(pk=size_id, then=Value(quantity)) for size_id, quantity in quantities.items()]
+            ),
+            in_stock=Case(
+                *[
+                    When(pk=size_id, stock_quantity=quantity, then=Value(False))
+                    for size_id, quantity in quantities.items()
+                ],
+                default=F('in_stock'),
+            ),
+        )
+
+        release(cart.holder)
+
+        # Продажа сразу поднимает товар в сортировке «по популярности»;
+        # затухание старых продаж пересчитывает команда update_popularity
+        sold = Counter()
+        for item in items:
+            sold[item.product.pk] += item.quantity
+        Product.objects.filter(pk__in=sold).update(
+            popularity=F('popularity') + Case(
+                *[When(pk=product_id, then=Value(float(quantity))) for product_id, quantity in sold.items()]
+            )
+        )
+
+    return order
@@ -0,0 +1,262 @@
+"""
+Кэш страниц каталога для анонимных посетителей.
+
+Страница кэшируется целиком, ключ - схема, хост, путь и разрешенные
+GET-параметры. Вместе со страницей хранится версия каталога (см.
+shop/cache.py): после любого изменения товаров страница пересчитывается,
+а до конца пересчета остальные посетители получают прежнюю.
+
+Персональные части страницы в кэш не попадают: счетчик корзины в шапке
+заполняет скрипт страницы из ``cart/state/``, а CSRF-токен формы при
+рендере для кэша заменяется меткой, которая при каждой выдаче
+заполняется токеном текущего посетителя.
+Страницы с сообщениями (``django.contrib.messages``) и страницы для
+авторизованных пользователей не кэшируются.
+
+Если база недоступна (``OperationalError``, например «database is
+locked» во время долгой записи) или чтение при пересчете страницы не
+укладывается в ``SHOP_DB_READ_BUDGET`` секунд, посетитель получает
+последнюю удачную копию страницы с заголовком ``X-Shop-Stale`` вместо
+ошибки 500. Счетчики таких случаев - ``degraded_stats()``.
+
+``catalog_conditional`` добавляет к страницам каталога валидаторы
+ETag/Last-Modified от версии каталога, и повторный запрос браузера или
+поискового робота получает 304 без запросов к базе и рендера шаблона.
+В ETag входит отпечаток CSRF-cookie посетителя: после смены токена
+(вход, новая cookie) страница с формой рендерится заново. Запросы,
+которые не кэшируются (авторизованные пользователи, сообщения),
+валидаторов не получают.
+"""
+import hashlib
+import logging
+import re
+from contextlib import nullcontext
+from datetime import datetime, time, timezone as dt_timezone
+from functools import wraps
+from time import monotonic
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.views.decorators.http import condition
+
+from .cache import get_catalog_changed_at, get_catalog_version, get_or_recompute
+
+# Параметры, от которых зависит содержимое страниц каталога
+CACHED_QUERY_PARAMS = ('size', 'price_min', 'price_max', 'q', 'sort', 'order', 'page', 'cursor')
+
+CSRF_TOKEN_MARKER = '[[shop-page-cache:csrf_token]]'
+CSRF_INPUT_RE = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+STALE_HEADER = 'X-Shop-Stale'
+
+logger = logging.getLogger(__name__)
+
+# Счетчики выдачи устаревших страниц в этом процессе
+_degraded = {'operational_error': 0, 'read_budget': 0}
+
+def page_cache_key(request):
+    """Ключ страницы: адрес и разрешенные параметры (версия хранится в значении)"""
+    params = sorted(
+        (name, value)
+        for name in CACHED_QUERY_PARAMS
+        for value in request.GET.getlist(name)
+        if value != ''
+    )
+    url = f'{request.scheme}://{request.get_host()}{request.path}?{urlencode(params)}'
+    return f'shop:page:{hashlib.md5(url.encode()).hexdigest()}'
+
+
+def has_messages(request):
+    """Есть ли у посетителя непоказанные сообщения (они не помечаются прочитанными)"""
+    return bool(len(messages.get_messages(request)))
+
+
+def is_cacheable(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.user.is_authenticated:
+        return False
+    # Сообщения показываются один раз и только этому посетителю
+    return not has_messages(request)
+
+
+def _csrf_fingerprint(request):
+    # CsrfViewMiddleware кладет сюда токен из cookie, get_token - новый
+    token = request.META.get('CSRF_COOKIE')
+    return hashlib.md5(token.encode()).hexdigest()[:8] if token else '-'
+
+
+def _etag(request, version):
+    return f'W/"{version}-{timezone.localdate():%Y%m%d}-{_csrf_fingerprint(request)}"'
+
+
+def catalog_etag(request, *args, **kwargs):
+    """
+    Слабый ETag страницы каталога: версия каталога, дата (подборка
+    новинок зависит от текущего дня) и отпечаток CSRF-cookie (токен
+    формы на странице). Некэшируемый запрос валидатора не получает и
+    всегда рендерится заново.
+    """
+    if not is_cacheable(request):
+        return None
+    return _etag(request, get_catalog_version())
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    """
+    Время изменения каталога, но не раньше начала текущего дня. Только
+    для посетителей без CSRF-cookie (роботы): по времени нельзя понять,
+    что сменился токен формы, браузеры перепроверяют страницу по ETag.
+    """
+    if not is_cacheable(request) or settings.CSRF_COOKIE_NAME in request.COOKIES:
+        return None
+    return _catalog_changed_at()
+
+
+def _catalog_changed_at():
+    today = timezone.make_aware(datetime.combine(timezone.localdate(), time.min))
+    return max(get_catalog_changed_at(), today.astimezone(dt_timezone.utc))
+
+
+# Условный GET для представлений каталога: 304, если каталог не менялся
+catalog_conditional = condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
+
+
+def _personalize(request, content):
+    """Подставляет в страницу из кэша CSRF-токен текущего посетителя"""
+    if CSRF_TOKEN_MARKER in content:
+        content = content.replace(CSRF_TOKEN_MARKER, get_token(request))
+    return content
+
+
+def degraded_stats():
+    """Сколько раз вместо ошибки отдана устаревшая страница, по причинам"""
+    return dict(_degraded)
+
+
+class ReadBudgetExceeded(OperationalError):
+    """Чтение из базы при рендере страницы не уложилось в бюджет времени"""
+
+
+def _read_budget_guard(budget):
+    """
+    Обертка запросов (``connection.execute_wrapper``): после того как
+    рендер потратил ``budget`` секунд, следующий запрос не выполняется
+    """
+    deadline = monotonic() + budget
+
+    def guard(execute, sql, params, many, context):
+        if monotonic() > deadline:
+            raise ReadBudgetExceeded(f'read budget of {budget}s exceeded')
+        return execute(sql, params, many, context)
+
+    return guard
+
+
+def _stale_response(request, key, error):
+    """Последняя удачная копия страницы вместо ошибки базы (или None)"""
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    reason = 'read_budget' if isinstance(error, ReadBudgetExceeded) else 'operational_error'
+    _degraded[reason] += 1
+    logger.warning('Serving stale page %s (%s): %s', request.path, reason, error)
+
+    (content_type, content), version = entry[0], entry[1]
+    response = HttpResponse(_personalize(request, content), content_type=content_type)
+    response[STALE_HEADER] = reason
+    _mark_stale(request, response, version)
+    return response
+
+
+def _mark_stale(request, response, version):
+    """
+    Свои валидаторы для страницы прежней версии каталога: catalog_conditional
+    не должен выдать ей ETag и Last-Modified текущей версии, иначе браузер
+    будет получать 304 на устаревшую копию
+    """
+    response['ETag'] = f'W/"stale-{version}"'
+    # На секунду раньше изменения каталога: If-Modified-Since по нему дает 200
+    response['Last-Modified'] = http_date(_catalog_changed_at().timestamp() - 1)
+    patch_cache_control(response, no_cache=True)
+
+
+class _Uncacheable(Exception):
+    """Ответ представления нельзя кэшировать (не 200): отдаем как есть"""
+
+    def __init__(self, response):
+        self.response = response
+
+
+def catalog_page_cache(view):
+    """
+    Декоратор представления каталога: страница из кэша для анонимов.
+
+    После изменения каталога страницу пересчитывает один запрос, а
+    остальные до его окончания получают предыдущую версию страницы
+    (см. ``get_or_recompute``) без кэширования в браузере.
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not is_cacheable(request):
+            return view(request, *args, **kwargs)
+
+        key = page_cache_key(request)
+
+        def render():
+            budget = getattr(settings, 'SHOP_DB_READ_BUDGET', None)
+            # Ждать базу дольше бюджета имеет смысл, только если отдать нечего
+            if budget is not None and cache.get(key) is not None:
+                guard = connection.execute_wrapper(_read_budget_guard(budget))
+            else:
+                guard = nullcontext()
+            with guard:
+                response = view(request, *args, **kwargs)
+                if hasattr(response, 'render') and not response.is_rendered:
+                    response.render()
+            if response.status_code != 200 or response.streaming:
+                raise _Uncacheable(response)
+            # Токен формы этого посетителя заменяется меткой в копии для кэша
+            content = response.content.decode(response.charset)
+            return response['Content-Type'], CSRF_INPUT_RE.sub(
+                rf'\g<1>{CSRF_TOKEN_MARKER}\g<2>', content
+            )
+
+        version = get_catalog_version()
+        try:
+            (content_type, content), page_version = get_or_recompute(
+                key,
+                render,
+                getattr(settings, 'SHOP_PAGE_CACHE_TIMEOUT', 600),
+                version=version,
+            )
+        except _Uncacheable as e:
+            return e.response
+        except OperationalError as e:
+            response = _stale_response(request, key, e)
+            if response is None:
+                raise
+            patch_vary_headers(response, ('Cookie',))
+            return response
+
+        response = HttpResponse(_personalize(request, content), content_type=content_type)
+        if page_version != version:
+            _mark_stale(request, response, page_version)
+        else:
+            # Первый ответ выдает посетителю CSRF-cookie: ETag уже с ней
+            response['ETag'] = _etag(request, version)
+        patch_vary_headers(response, ('Cookie',))
+        return response
+
+    # По этому признаку warm_cache отбирает адреса для прогрева
+    wrapper.page_cached = True
+    return wrapper
@@ -0,0 +1,232 @@
+"""
+Курсорная (keyset) пагинация для каталога.
+
+Вместо COUNT(*) и OFFSET страница выбирается условием
+«строго после ключа последнего товара предыдущей страницы», поэтому
+стоимость 500-й страницы такая же, как у первой. Ключ страницы
+передается в ссылках непрозрачным подписанным токеном ``cursor``.
+"""
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core import signing
+from django.db.models import Q
+
+CURSOR_SALT = 'shop.pagination.cursor'
+
+
+def _encode_value(value):
+    """Приводит значение ключа сортировки к виду, пригодному для JSON"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class KeysetPage:
+    """
+    Страница курсорной пагинации.
+
+    Повторяет ту часть интерфейса ``django.core.paginator.Page``, которую
+    используют шаблоны (итерация, ``number``, ``has_next`` и т.д.), и
+    добавляет ссылки на соседние страницы в виде курсоров.
+    """
+
+    def __init__(self, object_list, number, next_link, previous_link, page_links):
+        self.object_list = object_list
+        self.number = number
+        self.next_link = next_link
+        self.previous_link = previous_link
+        self.page_links = page_links
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def __repr__(self):
+        return f'<KeysetPage {self.number}>'
+
+    def has_next(self):
+        return self.next_link is not None
+
+    def has_previous(self):
+        return self.previous_link is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def show_first_link(self):
+        """Нужна ли отдельная ссылка на первую страницу перед полосой номеров"""
+        return bool(self.page_links) and self.page_links[0]['number'] > 1
+
+
+class KeysetPaginator:
+    """
+    Пагинатор по ключу сортировки с ``id`` в качестве последнего ключа.
+
+    ``ordering`` - список полей как для ``order_by`` (например ``['-price']``).
+
+    Старые ссылки вида ``?page=N`` продолжают работать: ключ начала
+    страницы находится одним запросом по индексируемым колонкам,
+    после чего навигация идет уже по курсорам.
+    """
+
+    cursor_param = 'cursor'
+    page_param = 'page'
+
+    def __init__(self, queryset, per_page, ordering, window=2):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.window = window
+
+        ordering = list(ordering)
+        if not any(f.lstrip('-') in ('id', 'pk') for f in ordering):
+            # id как последний ключ делает порядок строгим
+            ordering.append('-id' if ordering and ordering[0].startswith('-') else 'id')
+        self.ordering = ordering
+        self.fields = [f.lstrip('-') for f in ordering]
+
+    @property
+    def signature(self):
+        """Сигнатура сортировки, к которой привязан курсор"""
+        return ','.join(self.ordering)
+
+    # --- Курсоры ---
+
+    def encode_cursor(self, key, number):
+        return signing.dumps(
+            {'s': self.signature, 'k': [_encode_value(v) for v in key], 'n': number},
+            salt=CURSOR_SALT,
+            compress=True,
+        )
+
+    def decode_cursor(self, token):
+        """Возвращает (ключ, номер страницы) или None для неверного курсора"""
+        try:
+            data = signing.loads(token, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            return None
+        if not isinstance(data, dict) or data.get('s') != self.signature:
+            return None
+        key, number = data.get('k'), data.get('n')
+        if not isinstance(key, list) or len(key) != len(self.fields):
+            return None
+        if not isinstance(number, int) or number < 2:
+            return None
+        return key, number
+
+    def _link(self, key, number):
+        """Параметры ссылки на страницу ``number``, начинающуюся после ``key``"""
+        if number == 1:
+            return {'number': 1, 'cursor': None, 'page': None}
+        return {'number': number, 'cursor': self.encode_cursor(key, number), 'page': None}
+
+    # --- Запросы ---
+
+    def _ordered(self, reverse=False):
+        if not reverse:
+            return self.queryset.order_by(*self.ordering)
+        return self.queryset.order_by(
+            *[f[1:] if f.startswith('-') else f'-{f}' for f in self.ordering]
+        )
+
+    def _after(self, key, reverse=False):
+        """Условие «строго после ключа» в порядке сортировки (или перед ним)"""
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            descending = field.startswith('-') != reverse
+            lookup = 'lt' if descending else 'gt'
+            term = Q(**{f'{self.fields[i]}__{lookup}': key[i]})
+            for prev in range(i):
+                term &= Q(**{self.fields[prev]: key[prev]})
+            condition |= term
+        return condition
+
+    def _key_of(self, obj):
+        return [getattr(obj, field) for field in self.fields]
+
+    def _values(self, queryset, limit, offset=0):
+        """Только ключевые колонки: запрос обходится индексом сортировки"""
+        return [list(row) for row in queryset.values_list(*self.fields)[offset:offset + limit]]
+
+    def _legacy_key(self, number):
+        """Ключ последнего товара страницы ``number - 1`` для ссылок ``?page=``"""
+        keys = self._values(self._ordered(), 1, offset=(number - 1) * self.per_page - 1)
+        return keys[0] if keys else None
+
+    # --- Страницы ---
+
+    def get_page(self, request):
+        """Страница по параметрам ``cursor`` или ``page`` из GET-запроса"""
+        token = request.GET.get(self.cursor_param)
+        page = request.GET.get(self.page_param)
+
+        key, number = None, 1
+        if token:
+            decoded = self.decode_cursor(token)
+            if decoded:
+                key, number = decoded
+        elif page:
+            try:
+                number = max(int(page), 1)
+            except (TypeError, ValueError):
+                number = 1
+            if number > 1:
+                key = self._legacy_key(number)
+                if key is None:
+                    number = 1
+
+        return self._keyset_page(key, number)
+
+    def _keyset_page(self, key, number):
+        forward = self._ordered()
+        if key is not None:
+            forward = forward.filter(self._after(key))
+        object_list = list(forward[:self.per_page])
+        if not object_list and key is not None:
+            # Курсор указывает за конец выборки (товары удалены) - начинаем сначала
+            return self._keyset_page(None, 1)
+
+        page_links = []
+        if number > 1:
+            # Ключи предыдущих страниц - одним запросом назад от начала текущей
+            start = self._key_of(object_list[0])
+            keys = self._values(
+                self._ordered(reverse=True).filter(self._after(start, reverse=True)),
+                self.window * self.per_page + 1,
+            )
+            if len(keys) <= self.window * self.per_page:
+                # Начало выборки близко: уточняем номер, если данные сдвинулись
+                number = -(-len(keys) // self.per_page) + 1
+            for back in range(min(self.window, number - 1), 0, -1):
+                target = number - back
+                page_links.append(
+                    self._link(keys[back * self.per_page] if target > 1 else None, target)
+                )
+        previous_link = page_links[-1] if page_links else None
+
+        page_links.append({'number': number, 'cursor': None, 'page': None, 'current': True})
+
+        next_link = None
+        if len(object_list) == self.per_page:
+            last = self._key_of(object_list[-1])
+            keys = self._values(
+                self._ordered().filter(self._after(last)),
+                (self.window - 1) * self.per_page + 1,
+            )
+            for ahead in range(1, self.window + 1):
+                if len(keys) <= (ahead - 1) * self.per_page:
+                    break
+                boundary = last if ahead == 1 else keys[(ahead - 1) * self.per_page - 1]
+                page_links.append(self._link(boundary, number + ahead))
+                if ahead == 1:
+                    next_link = page_links[-1]
+
+        return KeysetPage(object_list, number, next_link, previous_link, page_links)
@@ -0,0 +1,152 @@
+"""
+Кэш результатов запросов ORM.
+
+    Product.objects.filter(category=category).cached(300)
+
+Результат ``.cached()``-выборки хранится в кэше Django под ключом из
+SQL-текста с параметрами и версий таблиц, которые участвуют в запросе
+(FROM и JOIN). Любое сохранение или удаление объекта любой модели, а
+также массовые ``update``/``bulk_create``/``bulk_update``/``delete``
+увеличивают версию таблицы модели, и все закэшированные запросы к ней
+перестают находиться. Версия меняется после фиксации транзакции записи:
+иначе параллельное чтение сохранило бы еще старые строки под новой
+версией.
+
+Таблицы подзапросов (``Exists``, ``Subquery``) не отслеживаются - такие
+выборки кэшировать не следует.
+"""
+import hashlib
+import time
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import models, transaction
+
+TABLE_VERSION_KEY = 'shop:table_version:{}'
+QUERY_KEY = 'shop:query:{}:{}'
+
+_stats = {'hits': 0, 'misses': 0}
+
+
+def query_cache_stats():
+    """Попадания и промахи кэша запросов в этом процессе"""
+    total = _stats['hits'] + _stats['misses']
+    return dict(_stats, hit_rate=_stats['hits'] / total if total else 0.0)
+
+
+def get_table_versions(tables):
+    keys = [TABLE_VERSION_KEY.format(table) for table in sorted(tables)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns() // 1000, timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _bump_tables(tables):
+    for table in tables:
+        key = TABLE_VERSION_KEY.format(table)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns() // 1000, timeout=None)
+
+
+def invalidate_tables(*tables, using=None):
+    """
+    Делает устаревшими все закэшированные запросы к таблицам после
+    фиксации текущей транзакции (вне транзакции - сразу)
+    """
+    tables = set(tables)
+    transaction.on_commit(lambda: _bump_tables(tables), using=using)
+
+
+def invalidate_models(*model_classes, using=None):
+    invalidate_tables(*(model._meta.db_table for model in model_classes), using=using)
+
+
+class CachedQuerySet(models.QuerySet):
+    """
+    QuerySet с методом ``cached()``; массовые изменения через него
+    инвалидируют кэш запросов к таблице модели.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cache_timeout = None
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._cache_timeout = self._cache_timeout
+        return clone
+
+    def cached(self, timeout=300):
+        """Результат выборки будет взят из кэша запросов"""
+        clone = self._chain()
+        clone._cache_timeout = timeout
+        return clone
+
+    def _query_cache_key(self, query, extra=''):
+        sql, params = query.get_compiler(using=self.db).as_sql()
+        # Таблицы известны после компиляции: она добавляет JOIN-ы в alias_map
+        tables = {join.table_name for join in query.alias_map.values()}
+        digest = hashlib.md5(f'{self.db}|{sql}|{params!r}|{extra}'.encode()).hexdigest()
+        versions = '-'.join(str(version) for version in get_table_versions(tables))
+        return QUERY_KEY.format(digest, versions)
+
+    def _cached_call(self, query, compute, extra=''):
+        key = self._query_cache_key(query, extra)
+        result = cache.get(key)
+        if result is not None:
+            _stats['hits'] += 1
+            return result
+        _stats['misses'] += 1
+        result = compute()
+        cache.set(key, result, self._cache_timeout)
+        return result
+
+    def _fetch_all(self):
+        if self._result_cache is None and self._cache_timeout is not None:
+            def compute():
+                super(CachedQuerySet, self)._fetch_all()
+                return self._result_cache
+
+            self._result_cache = self._cached_call(self.query.chain(), compute, 'rows')
+        super()._fetch_all()
+
+    def aggregate(self, *args, **kwargs):
+        if self._cache_timeout is None:
+            return super().aggregate(*args, **kwargs)
+        extra = f'aggregate|{args!r}|{sorted(kwargs.items())!r}'
+        return self._cached_call(
+            self.query.chain(), lambda: super(CachedQuerySet, self).aggregate(*args, **kwargs), extra
+        )
+
+    def count(self):
+        if self._cache_timeout is None or self._result_cache is not None:
+            return super().count()
+        return self._cached_call(self.query.chain(), lambda: super(CachedQuerySet, self).count(), 'count')
+
+    # --- Массовые изменения ---
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        invalidate_models(self.model, using=self.db)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        invalidate_models(self.model, using=self.db)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        invalidate_models(self.model, using=self.db)
+        return rows
+
+    def delete(self):
+        deleted, per_model = super().delete()
+        # Каскадно удаленные строки других моделей тоже меняют их таблицы
+        invalidate_models(self.model, *(apps.get_model(label) for label in per_model), using=self.db)
+        return deleted, per_model
@@ -0,0 +1,84 @@
+"""
+Справочники каталога в памяти процесса.
+
+Активные категории (со ссылками на родителей и числом товаров), размеры
+и набор размеров, которые есть в наличии, меняются редко, а нужны почти
+каждой странице. Они загружаются четырьмя запросами и хранятся в
+процессе до смены версии каталога (см. shop/cache.py), которую
+увеличивает любое сохранение категорий, размеров и остатков. Снимок
+также лежит в общем кэше, и после изменения каталога его пересчитывает
+только один процесс.
+
+Объекты справочника общие для всех запросов процесса - их нельзя изменять.
+"""
+import threading
+
+from .cache import get_catalog_version, get_or_recompute
+
+REFERENCE_CACHE_KEY = 'shop:reference_data'
+REFERENCE_TIMEOUT = 60 * 60
+
+
+class ReferenceData:
+    """Неизменяемый снимок справочников"""
+
+    def __init__(self, version, categories, sizes, in_stock_size_ids, product_counts):
+        self.version = version
+        by_id = {category.pk: category for category in categories}
+        for category in categories:
+            # Родитель из того же снимка, без запроса при обращении
+            category.parent = by_id.get(category.parent_id)
+            category.products_count = product_counts.get(category.pk, 0)
+        self.categories = [category for category in categories if category.is_active]
+        self.categories_by_slug = {category.slug: category for category in self.categories}
+        self.sizes = sizes
+        self.sizes_in_stock = [size for size in sizes if size.pk in in_stock_size_ids]
+
+    def get_category(self, slug):
+        """Активная категория по slug или None"""
+        return self.categories_by_slug.get(slug)
+
+
+def load_reference_data(version=None):
+    from django.db.models import Count
+
+    from .models import Category, Product, ProductSize, Size
+
+    in_stock_size_ids = set(
+        ProductSize.objects.filter(in_stock=True)
+        .values_list('size_id', flat=True)
+        .distinct()
+    )
+    product_counts = dict(
+        Product.objects.values_list('category_id').annotate(Count('pk')).order_by()
+    )
+    return ReferenceData(
+        version,
+        list(Category.objects.all()),
+        list(Size.objects.all()),
+        in_stock_size_ids,
+        product_counts,
+    )
+
+
+_data = None
+_lock = threading.Lock()
+
+
+def get_reference_data():
+    """
+    Справочники для текущей версии каталога. Пока другой процесс
+    пересчитывает снимок, возвращается предыдущий.
+    """
+    global _data
+    version = get_catalog_version()
+    if _data is None or _data.version != version:
+        with _lock:
+            if _data is None or _data.version != version:
+                _data, _ = get_or_recompute(
+                    REFERENCE_CACHE_KEY,
+                    lambda: load_reference_data(version),
+                    REFERENCE_TIMEOUT,
+                    version=version,
+                )
+    return _data
@@ -0,0 +1,87 @@
+"""
+Резервы товаров в корзинах.
+
+Добавление в корзину откладывает товар на ``SHOP_RESERVATION_TTL``
+секунд (каждое изменение строки продлевает срок). Пока резерв
+действует, товар не продается другим покупателям: доступный остаток
+размера - ``stock_quantity`` минус действующие резервы чужих корзин.
+Резерв снимается при удалении строки, при оформлении заказа и по
+истечении срока (командой ``release_reservations``; истекшие резервы
+в расчете остатка и без нее не участвуют).
+
+Резерв принадлежит корзине, а не сессии: ``Cart.ensure_holder()``.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import ProductSize, StockReservation
+
+RESERVATION_TTL = 15 * 60
+
+
+class ReservationError(Exception):
+    """Товара не хватает с учетом резервов других покупателей"""
+
+
+def reservation_ttl():
+    return timedelta(seconds=getattr(settings, 'SHOP_RESERVATION_TTL', RESERVATION_TTL))
+
+
+def reserved_quantities(size_ids, exclude_holder=None):
+    """
+    Действующие резервы по id размеров (без резервов ``exclude_holder``).
+    Один запрос по индексу (product_size, expires_at).
+    """
+    reservations = StockReservation.objects.filter(
+        product_size_id__in=size_ids, expires_at__gt=timezone.now()
+    )
+    if exclude_holder:
+        reservations = reservations.exclude(holder=exclude_holder)
+    return dict(
+        reservations.values_list('product_size_id').annotate(Sum('quantity')).order_by()
+    )
+
+
+def available_to_sell(product_size, holder=None):
+    """Сколько штук размера можно положить в корзину ``holder``"""
+    reserved = reserved_quantities([product_size.pk], exclude_holder=holder).get(product_size.pk, 0)
+    return max(product_size.stock_quantity - reserved, 0)
+
+
+def reserve(product_size, holder, quantity):
+    """
+    Резервирует ``quantity`` штук размера за корзиной (всего, а не
+    сверх уже отложенного) и продлевает срок резерва. Если товара не
+    хватает, вызывает ``ReservationError``.
+    """
+    with transaction.atomic():
+        # Строка размера блокируется, как в place_order: параллельные резервы
+        # одного размера проверяют остаток по очереди и по свежему значению.
+        # На SQLite транзакция и так сразу берет блокировку записи (BEGIN IMMEDIATE)
+        product_size = ProductSize.objects.select_for_update().get(pk=product_size.pk)
+        if quantity > available_to_sell(product_size, holder):
+            raise ReservationError('Недостаточно товара на складе: часть отложена другими покупателями')
+        StockReservation.objects.update_or_create(
+            holder=holder,
+            product_size=product_size,
+            defaults={'quantity': quantity, 'expires_at': timezone.now() + reservation_ttl()},
+        )
+
+
+def release(holder, size_id=None):
+    """Снимает резервы корзины (все или одного размера)"""
+    if not holder:
+        return 0
+    reservations = StockReservation.objects.filter(holder=holder)
+    if size_id is not None:
+        reservations = reservations.filter(product_size_id=size_id)
+    return reservations.delete()[0]
+
+
+def release_expired(now=None):
+    """Удаляет истекшие резервы, возвращает их число"""
+    return StockReservation.objects.filter(expires_at__lte=now or timezone.now()).delete()[0]
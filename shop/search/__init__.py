@@ -0,0 +1,58 @@
+"""
+Поиск по каталогу.
+
+Бэкенд выбирается по настройке ``SHOP_SEARCH_BACKEND`` (путь к классу),
+а если она не задана - по типу базы данных: FTS5 для SQLite,
+tsvector для PostgreSQL, ``icontains`` для остальных.
+"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from .backends import (
+    BaseSearchBackend,
+    BasicSearchBackend,
+    PostgresSearchBackend,
+    SQLiteFTSSearchBackend,
+)
+
+__all__ = [
+    'BaseSearchBackend',
+    'BasicSearchBackend',
+    'PostgresSearchBackend',
+    'SQLiteFTSSearchBackend',
+    'fuzzy_search_products',
+    'get_search_backend',
+    'search_products',
+]
+
+
+def _sqlite_has_fts5():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    """Возвращает экземпляр бэкенда поиска (один на процесс)"""
+    backend_path = getattr(settings, 'SHOP_SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)()
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if connection.vendor == 'sqlite' and _sqlite_has_fts5():
+        return SQLiteFTSSearchBackend()
+    return BasicSearchBackend()
+
+
+def search_products(queryset, query):
+    """Фильтрует товары по поисковому запросу и добавляет ``search_rank``"""
+    return get_search_backend().search(queryset, query)
+
+
+def fuzzy_search_products(queryset, query):
+    """Нечеткий поиск по триграммам названий (для запросов с опечатками)"""
+    return get_search_backend().fuzzy_search(queryset, query)
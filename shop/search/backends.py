@@ -0,0 +1,351 @@
+"""
+Бэкенды полнотекстового поиска товаров.
+
+Все бэкенды реализуют один интерфейс:
+
+* ``search(queryset, query)`` - отфильтровать товары по запросу и
+  аннотировать их полем ``search_rank`` (меньше - релевантнее);
+* ``index_products(product_ids)`` / ``remove_products(product_ids)`` -
+  инкрементальное обновление индекса;
+* ``fuzzy_search(queryset, query)`` - нечеткий поиск по триграммам
+  названий товаров и категорий (для запросов с опечатками);
+* ``rebuild()`` - полное перестроение индекса.
+"""
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import Case, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Least
+
+from .stemmer import WORD_RE, tokenize
+from .trigrams import MAX_QUERY_WORDS, text_trigrams, word_trigrams, words
+
+# Веса полей: название важнее категории, категория важнее описания
+NAME_WEIGHT = 10.0
+CATEGORY_WEIGHT = 4.0
+DESCRIPTION_WEIGHT = 1.0
+
+# Порог сходства и число кандидатов нечеткого поиска
+SIMILARITY_THRESHOLD = 0.3
+FUZZY_PRODUCT_LIMIT = 50
+FUZZY_CATEGORY_LIMIT = 5
+
+
+def _column(model, name):
+    """Столбец таблицы модели во внешнем запросе (для подзапросов RawSQL)"""
+    qn = connection.ops.quote_name
+    return f'{qn(model._meta.db_table)}.{qn(name)}'
+
+
+def _chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class BaseSearchBackend:
+    """Базовый бэкенд: общая логика обхода товаров для индексации"""
+
+    batch_size = 500
+
+    def search(self, queryset, query):
+        raise NotImplementedError
+
+    def fuzzy_search(self, queryset, query):
+        """Без индекса триграмм нечеткий поиск не выполняется"""
+        return queryset.none()
+
+    def index_products(self, product_ids):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def remove_category(self, category_id):
+        pass
+
+    def clear(self):
+        pass
+
+    def rebuild(self):
+        """Полностью перестраивает индекс; возвращает число проиндексированных товаров"""
+        from ..models import Product
+
+        self.clear()
+        product_ids = list(Product.objects.values_list('pk', flat=True))
+        for batch in _chunks(product_ids, self.batch_size):
+            self.index_products(batch)
+        return len(product_ids)
+
+    def index_category(self, category_id):
+        """Переиндексирует товары категории (название категории входит в индекс)"""
+        from ..models import Product
+
+        product_ids = Product.objects.filter(category_id=category_id).values_list('pk', flat=True)
+        for batch in _chunks(product_ids, self.batch_size):
+            self.index_products(batch)
+
+
+class BasicSearchBackend(BaseSearchBackend):
+    """
+    Поиск через ``icontains`` без индекса и ранжирования.
+    Используется для баз без полнотекстового поиска.
+    """
+
+    def search(self, queryset, query):
+        return queryset.filter(
+            Q(name__icontains=query) |
+            Q(description__icontains=query) |
+            Q(category__name__icontains=query)
+        ).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class SQLiteFTSSearchBackend(BaseSearchBackend):
+    """
+    Индекс FTS5 в SQLite. Русская морфология обеспечивается стеммером:
+    в индекс и в запрос попадают основы слов, ранжирование - bm25().
+    """
+
+    table = 'shop_product_fts'
+    trigram_table = 'shop_search_trigram'
+
+    def _match_expression(self, query):
+        terms = [token.replace('"', '""') for token in tokenize(query)]
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def search(self, queryset, query):
+        match = self._match_expression(query)
+        if not match:
+            return queryset.none()
+        rank = RawSQL(
+            f'SELECT bm25({self.table}, %s, %s, %s) FROM {self.table} '
+            f'WHERE {self.table} MATCH %s AND rowid = {_column(queryset.model, "id")}',
+            (NAME_WEIGHT, DESCRIPTION_WEIGHT, CATEGORY_WEIGHT, match),
+            output_field=FloatField(),
+        )
+        return queryset.filter(
+            pk__in=RawSQL(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', (match,))
+        ).annotate(search_rank=rank)
+
+    def index_products(self, product_ids):
+        from ..models import Product
+
+        product_ids = list(product_ids)
+        rows = Product.objects.filter(pk__in=product_ids).values_list(
+            'pk', 'name', 'description', 'category__name'
+        )
+        with connection.cursor() as cursor:
+            self._delete(cursor, product_ids)
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, name, description, category) VALUES (%s, %s, %s, %s)',
+                [
+                    (pk, ' '.join(tokenize(name)), ' '.join(tokenize(description)),
+                     ' '.join(tokenize(category)))
+                    for pk, name, description, category in rows
+                ],
+            )
+            self._insert_trigrams(cursor, 'p', [(pk, name) for pk, name, _, _ in rows])
+
+    def index_category(self, category_id):
+        from ..models import Category
+
+        with connection.cursor() as cursor:
+            self._delete_trigrams(cursor, 'c', [category_id])
+            self._insert_trigrams(
+                cursor, 'c', Category.objects.filter(pk=category_id).values_list('pk', 'name')
+            )
+        super().index_category(category_id)
+
+    def remove_products(self, product_ids):
+        with connection.cursor() as cursor:
+            self._delete(cursor, list(product_ids))
+
+    def remove_category(self, category_id):
+        with connection.cursor() as cursor:
+            self._delete_trigrams(cursor, 'c', [category_id])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(f'DELETE FROM {self.trigram_table}')
+
+    def rebuild(self):
+        from ..models import Category
+
+        count = super().rebuild()
+        with connection.cursor() as cursor:
+            self._insert_trigrams(cursor, 'c', Category.objects.values_list('pk', 'name'))
+        return count
+
+    def _delete(self, cursor, product_ids):
+        for batch in _chunks(product_ids, self.batch_size):
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({placeholders})', batch)
+        self._delete_trigrams(cursor, 'p', product_ids)
+
+    # --- Триграммы ---
+
+    def _insert_trigrams(self, cursor, kind, rows):
+        cursor.executemany(
+            f'INSERT OR IGNORE INTO {self.trigram_table} '
+            f'(trigram, kind, object_id, word_no, total) VALUES (%s, %s, %s, %s, %s)',
+            [
+                (trigram, kind, pk, number, len(trigrams))
+                for pk, name in rows
+                for number, trigrams in text_trigrams(name)
+                for trigram in trigrams
+            ],
+        )
+
+    def _delete_trigrams(self, cursor, kind, object_ids):
+        for batch in _chunks(object_ids, self.batch_size):
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(
+                f'DELETE FROM {self.trigram_table} WHERE kind = %s AND object_id IN ({placeholders})',
+                [kind, *batch],
+            )
+
+    def _word_matches(self, cursor, word):
+        """
+        Объекты, у которых есть слово, похожее на ``word``. Читаются только
+        записи индекса с триграммами этого слова (по первичному ключу).
+        """
+        trigrams = sorted(word_trigrams(word))
+        placeholders = ', '.join(['%s'] * len(trigrams))
+        cursor.execute(
+            f'SELECT kind, object_id, MAX(similarity) FROM ('
+            f'  SELECT kind, object_id, COUNT(*) * 1.0 / (%s + MAX(total) - COUNT(*)) AS similarity'
+            f'  FROM {self.trigram_table} WHERE trigram IN ({placeholders})'
+            f'  GROUP BY kind, object_id, word_no'
+            f') WHERE similarity >= %s GROUP BY kind, object_id',
+            [len(trigrams), *trigrams, SIMILARITY_THRESHOLD],
+        )
+        return cursor.fetchall()
+
+    def fuzzy_search(self, queryset, query):
+        query_words = words(query)[:MAX_QUERY_WORDS]
+        if not query_words:
+            return queryset.none()
+
+        # Сходство объекта - среднее по словам запроса лучшего совпадения слова
+        scores = defaultdict(float)
+        with connection.cursor() as cursor:
+            for word in query_words:
+                for kind, object_id, similarity in self._word_matches(cursor, word):
+                    scores[kind, object_id] += similarity / len(query_words)
+
+        def best(kind, limit):
+            found = [(score, pk) for (k, pk), score in scores.items()
+                     if k == kind and score >= SIMILARITY_THRESHOLD]
+            return sorted(found, reverse=True)[:limit]
+
+        products = best('p', FUZZY_PRODUCT_LIMIT)
+        categories = best('c', FUZZY_CATEGORY_LIMIT)
+        if not (products or categories):
+            return queryset.none()
+
+        no_match = Value(0.0, output_field=FloatField())
+        product_rank = Case(
+            *[When(pk=pk, then=Value(-score)) for score, pk in products],
+            default=no_match, output_field=FloatField(),
+        )
+        category_rank = Case(
+            *[When(category_id=pk, then=Value(-score)) for score, pk in categories],
+            default=no_match, output_field=FloatField(),
+        )
+        return queryset.filter(
+            Q(pk__in=[pk for _, pk in products]) |
+            Q(category_id__in=[pk for _, pk in categories])
+        ).annotate(search_rank=Least(product_rank, category_rank))
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Индекс tsvector с конфигурацией ``russian`` в отдельной таблице
+    с GIN-индексом. Ранжирование - ts_rank_cd с весами A/B/C.
+    """
+
+    table = 'shop_product_search'
+    config = 'russian'
+
+    def _tsquery(self, query):
+        # Каждое слово - префиксный терм, все термы обязательны;
+        # морфологию разбирает сам PostgreSQL
+        terms = WORD_RE.findall(query.lower())
+        return ' & '.join(f'{term}:*' for term in terms)
+
+    def search(self, queryset, query):
+        tsquery = self._tsquery(query)
+        if not tsquery:
+            return queryset.none()
+        rank = RawSQL(
+            f'SELECT -ts_rank_cd(document, to_tsquery(%s, %s)) FROM {self.table} '
+            f'WHERE product_id = {_column(queryset.model, "id")}',
+            (self.config, tsquery),
+            output_field=FloatField(),
+        )
+        return queryset.filter(
+            pk__in=RawSQL(
+                f'SELECT product_id FROM {self.table} WHERE document @@ to_tsquery(%s, %s)',
+                (self.config, tsquery),
+            )
+        ).annotate(search_rank=rank)
+
+    def fuzzy_search(self, queryset, query):
+        """
+        Нечеткий поиск через pg_trgm: оператор ``<%`` (word_similarity)
+        использует GIN-индексы по названиям товаров и категорий
+        """
+        query = ' '.join(words(query)[:MAX_QUERY_WORDS])
+        if not query:
+            return queryset.none()
+        product_table = queryset.model._meta.db_table
+        category_table = queryset.model._meta.get_field('category').related_model._meta.db_table
+        candidates = RawSQL(
+            f'(SELECT id FROM {product_table} WHERE %s <%% name '
+            f' ORDER BY word_similarity(%s, name) DESC LIMIT %s) '
+            f'UNION '
+            f'(SELECT p.id FROM {product_table} p JOIN ('
+            f'   SELECT id FROM {category_table} WHERE %s <%% name '
+            f'   ORDER BY word_similarity(%s, name) DESC LIMIT %s'
+            f' ) c ON p.category_id = c.id)',
+            (query, query, FUZZY_PRODUCT_LIMIT, query, query, FUZZY_CATEGORY_LIMIT),
+        )
+        rank = RawSQL(
+            f'-GREATEST(word_similarity(%s, {_column(queryset.model, "name")}), '
+            f'(SELECT word_similarity(%s, c.name) FROM {category_table} c '
+            f'  WHERE c.id = {_column(queryset.model, "category_id")}))',
+            (query, query),
+            output_field=FloatField(),
+        )
+        return queryset.filter(pk__in=candidates).annotate(search_rank=rank)
+
+    def index_products(self, product_ids):
+        from ..models import Category, Product
+
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'''
+                INSERT INTO {self.table} (product_id, document)
+                SELECT p.id,
+                       setweight(to_tsvector(%s, p.name), 'A') ||
+                       setweight(to_tsvector(%s, c.name), 'B') ||
+                       setweight(to_tsvector(%s, coalesce(p.description, '')), 'C')
+                FROM {Product._meta.db_table} p JOIN {Category._meta.db_table} c ON c.id = p.category_id
+                WHERE p.id = ANY(%s)
+                ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document
+                ''',
+                (self.config, self.config, self.config, product_ids),
+            )
+
+    def remove_products(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE product_id = ANY(%s)', (list(product_ids),))
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {self.table}')
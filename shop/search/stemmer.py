@@ -0,0 +1,93 @@
+"""
+Стеммер русского языка (алгоритм Snowball для русского, М. Портер).
+
+Используется для индексации и поисковых запросов там, где у базы данных
+нет собственной русской морфологии (SQLite FTS5).
+"""
+import re
+
+VOWELS = 'аеиоуыэюя'
+
+PERFECTIVE_GERUND = re.compile(r'(ив|ивши|ившись|ыв|ывши|ывшись|(?<=[ая])(в|вши|вшись))$')
+REFLEXIVE = re.compile(r'(ся|сь)$')
+ADJECTIVE = re.compile(
+    r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$'
+)
+PARTICIPLE = re.compile(r'(ивш|ывш|ующ|(?<=[ая])(ем|нн|вш|ющ|щ))$')
+VERB = re.compile(
+    r'(ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|'
+    r'ены|ить|ыть|ишь|ую|ю|(?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно))$'
+)
+NOUN = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|'
+    r'ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+SUPERLATIVE = re.compile(r'(ейш|ейше)$')
+DERIVATIONAL = re.compile(r'(ост|ость)$')
+
+WORD_RE = re.compile(r'\w+')
+CYRILLIC_RE = re.compile(r'[а-я]')
+
+
+def _region(word, start=0):
+    """Начало области после первой пары «гласная + согласная» (R1/R2 по Snowball)"""
+    for i in range(start + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            return i + 1
+    return len(word)
+
+
+def _strip(pattern, word, rv, min_start=None):
+    """Удаляет окончание, если оно целиком лежит в RV (и в R2, если задано)"""
+    match = pattern.search(word[rv:])
+    if not match:
+        return word, False
+    start = rv + match.start()
+    if min_start is not None and start < min_start:
+        return word, False
+    return word[:start], True
+
+
+def stem(word):
+    """Возвращает основу русского слова; прочие слова только приводит к нижнему регистру"""
+    word = word.lower().replace('ё', 'е')
+    if not CYRILLIC_RE.search(word):
+        return word
+
+    rv = next((i + 1 for i, ch in enumerate(word) if ch in VOWELS), len(word))
+    r2 = _region(word, _region(word))
+
+    # Шаг 1
+    word, found = _strip(PERFECTIVE_GERUND, word, rv)
+    if not found:
+        word, _ = _strip(REFLEXIVE, word, rv)
+        word, found = _strip(ADJECTIVE, word, rv)
+        if found:
+            word, _ = _strip(PARTICIPLE, word, rv)
+        else:
+            word, found = _strip(VERB, word, rv)
+            if not found:
+                word, _ = _strip(NOUN, word, rv)
+
+    # Шаг 2
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    # Шаг 3
+    word, _ = _strip(DERIVATIONAL, word, rv, min_start=r2)
+
+    # Шаг 4
+    if word.endswith('нн') and len(word) - 2 >= rv:
+        word = word[:-1]
+    else:
+        word, found = _strip(SUPERLATIVE, word, rv)
+        if found and word.endswith('нн'):
+            word = word[:-1]
+        elif word.endswith('ь') and len(word) - 1 >= rv:
+            word = word[:-1]
+    return word
+
+
+def tokenize(text):
+    """Разбивает текст на слова и возвращает их основы"""
+    return [stem(token) for token in WORD_RE.findall(text or '')]
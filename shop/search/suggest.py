@@ -0,0 +1,107 @@
+"""
+Подсказки поиска по префиксу из внутрипроцессного индекса.
+
+Индекс - отсортированный массив ключей (название целиком и каждое его
+слово с позиции начала слова) и поиск диапазона бинарным поиском.
+Для коротких префиксов (1-3 символа), где диапазон большой, лучшие
+подсказки посчитаны заранее. Индекс строится из активных товаров и
+категорий и перестраивается, когда меняется версия каталога, так что
+сами запросы подсказок в базу данных не ходят.
+"""
+import heapq
+import threading
+from bisect import bisect_left
+
+from django.urls import reverse
+
+from ..cache import get_catalog_version
+from .stemmer import WORD_RE
+
+SHORT_PREFIX_LENGTH = 3
+MAX_SUGGESTIONS = 20
+
+
+def normalize(text):
+    return ' '.join(WORD_RE.findall((text or '').lower().replace('ё', 'е')))
+
+
+class PrefixIndex:
+    """Неизменяемый индекс подсказок"""
+
+    def __init__(self, entries):
+        # entries: (вес, тип, название, url); меньший вес - выше в выдаче
+        self.entries = sorted(entries)
+        keys = []
+        for position, (_, _, name, _) in enumerate(self.entries):
+            normalized = normalize(name)
+            starts = [0] + [i + 1 for i, ch in enumerate(normalized) if ch == ' ']
+            keys.extend((normalized[start:], position) for start in starts)
+        keys.sort()
+        self.keys = [key for key, _ in keys]
+        self.positions = [position for _, position in keys]
+
+        self.short = {}
+        for key, position in zip(self.keys, self.positions):
+            for length in range(1, SHORT_PREFIX_LENGTH + 1):
+                if len(key) >= length:
+                    self.short.setdefault(key[:length], set()).add(position)
+        self.short = {
+            prefix: sorted(positions)[:MAX_SUGGESTIONS]
+            for prefix, positions in self.short.items()
+        }
+
+    def _range(self, prefix):
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + '\uffff', start)
+        return self.positions[start:end]
+
+    def suggest(self, query, limit=8):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        limit = min(limit, MAX_SUGGESTIONS)
+        if len(prefix) <= SHORT_PREFIX_LENGTH:
+            positions = self.short.get(prefix, [])
+        else:
+            positions = heapq.nsmallest(limit, set(self._range(prefix)))
+        return [
+            {'type': kind, 'name': name, 'url': url}
+            for _, kind, name, url in (self.entries[p] for p in positions[:limit])
+        ]
+
+
+def build_index():
+    """Строит индекс из активных категорий и товаров (товары - по популярности)"""
+    from ..models import Category, Product
+
+    entries = [
+        (0, 'category', name, reverse('shop:product_list_by_category', args=[slug]))
+        for name, slug in Category.objects.filter(is_active=True).values_list('name', 'slug')
+    ]
+    products = Product.objects.filter(is_active=True).order_by('-popularity', 'name')
+    entries.extend(
+        (rank, 'product', name, reverse('shop:product_detail', args=[slug]))
+        for rank, (name, slug) in enumerate(products.values_list('name', 'slug'), start=1)
+    )
+    return PrefixIndex(entries)
+
+
+_index = None
+_index_version = None
+_lock = threading.Lock()
+
+
+def get_suggest_index():
+    """Индекс для текущей версии каталога; перестраивается одним потоком"""
+    global _index, _index_version
+    version = get_catalog_version()
+    if _index is None or _index_version != version:
+        with _lock:
+            if _index is None or _index_version != version:
+                _index = build_index()
+                _index_version = version
+    return _index
+
+
+def suggest(query, limit=8):
+    return get_suggest_index().suggest(query, limit)
@@ -0,0 +1,24 @@
+"""
+Триграммы слов для нечеткого поиска (как в расширении pg_trgm:
+слово дополняется двумя пробелами слева и одним справа).
+"""
+from .stemmer import WORD_RE
+
+# Ограничения, чтобы нечеткий поиск не превращался в полный просмотр
+MAX_QUERY_WORDS = 5
+MAX_WORD_LENGTH = 30
+
+
+def words(text):
+    """Слова текста в нижнем регистре, ё заменяется на е"""
+    return WORD_RE.findall((text or '').lower().replace('ё', 'е'))
+
+
+def word_trigrams(word):
+    padded = f'  {word[:MAX_WORD_LENGTH]} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def text_trigrams(text):
+    """Список (номер слова, множество триграмм) для индексации"""
+    return [(number, word_trigrams(word)) for number, word in enumerate(words(text))]
@@ -0,0 +1,104 @@
+"""
+Движок сессий магазина: маленькие сессии в cookie, большие - в базе.
+
+    SESSION_ENGINE = 'shop.sessions'
+    SHOP_SESSION_COOKIE_MAX_SIZE = 2048   # 0 - всегда cached_db
+
+Сессия анонимного покупателя (корзина из нескольких строк) хранится в
+самой cookie: сжатые подписанные данные, как у
+``django.contrib.sessions.backends.signed_cookies``. Такие посетители
+не создают строк в ``django_session`` и не пишут в базу. Если данные
+не помещаются в ``SHOP_SESSION_COOKIE_MAX_SIZE`` байт или в сессии есть
+вход пользователя (его нужно уметь отозвать на сервере), сессия
+хранится как ``cached_db``: ключ в cookie, данные в кэше и в базе.
+
+Тип сессии определяется по значению cookie: подписанные данные
+содержат ``:``, ключи базы - нет. Поэтому существующие сессии в базе
+продолжают читаться. Когда данные снова помещаются в cookie, строка
+сессии удаляется из базы.
+
+Счетчики сохранений по типам - ``session_stats()``.
+"""
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.core import signing
+
+# Та же соль, что у signed_cookies: сессии этого движка читаются обоими
+COOKIE_SALT = 'django.contrib.sessions.backends.signed_cookies'
+
+# Сохранения сессий в этом процессе: в cookie и в базу; удаленные строки базы
+_stats = {'cookie_saves': 0, 'db_saves': 0, 'db_deletes': 0}
+
+
+def session_stats():
+    """Сколько сессий сохранено в cookie и в базу этим процессом"""
+    return dict(_stats)
+
+
+def is_cookie_key(session_key):
+    return bool(session_key) and ':' in session_key
+
+
+class SessionStore(CachedDBStore):
+    def _cookie_payload(self, data):
+        """Подписанные данные для cookie или None, если им место в базе"""
+        max_size = getattr(settings, 'SHOP_SESSION_COOKIE_MAX_SIZE', 2048)
+        if not max_size or SESSION_KEY in data:
+            return None
+        payload = signing.dumps(data, compress=True, salt=COOKIE_SALT, serializer=self.serializer)
+        return payload if len(payload) <= max_size else None
+
+    def load(self):
+        if not is_cookie_key(self.session_key):
+            return super().load()
+        try:
+            return signing.loads(
+                self.session_key,
+                serializer=self.serializer,
+                max_age=self.get_session_cookie_age(),
+                salt=COOKIE_SALT,
+            )
+        except Exception:
+            # Подпись не сошлась или срок истек: новая пустая сессия
+            self._session_key = None
+            return {}
+
+    def exists(self, session_key):
+        if is_cookie_key(session_key):
+            return False
+        return super().exists(session_key)
+
+    def save(self, must_create=False):
+        payload = self._cookie_payload(self._get_session(no_load=must_create))
+        if payload is None:
+            if is_cookie_key(self.session_key):
+                # Данные выросли: переезд из cookie в базу под новым ключом
+                self._session_key = None
+            if self.session_key is not None:
+                # Без ключа save() вызовет create(), а тот - save() с ключом
+                _stats['db_saves'] += 1
+            return super().save(must_create)
+
+        if self.session_key and not must_create and not is_cookie_key(self.session_key):
+            # Данные уменьшились: строка в базе больше не нужна
+            super().delete(self.session_key)
+            _stats['db_deletes'] += 1
+        self._session_key = payload
+        _stats['cookie_saves'] += 1
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            session_key = self.session_key
+        if is_cookie_key(session_key):
+            if session_key == self.session_key:
+                self._session_key = None
+            return
+        super().delete(session_key)
+
+    def cycle_key(self):
+        if is_cookie_key(self.session_key):
+            # Подпись включает время: новое значение cookie и есть новый ключ
+            self.save()
+            return
+        super().cycle_key()
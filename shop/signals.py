@@ -0,0 +1,74 @@
+"""
+Обработчики сигналов моделей магазина
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_catalog_version_on_commit
+from .models import Category, Product, ProductImage, ProductReview, ProductSize, Size
+from .querycache import invalidate_models
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=ProductSize)
+@receiver(post_delete, sender=ProductSize)
+def refresh_product_stock_summary(sender, instance, **kwargs):
+    """Пересчитывает сводку наличия товара при изменении его размеров"""
+    Product.objects.filter(pk=instance.product_id).refresh_stock_summary()
+
+
+@receiver(post_save, sender=Product)
+def refresh_own_stock_summary(sender, instance, created, update_fields=None, **kwargs):
+    """Базовая цена товара участвует в сводке цен размеров без своей цены"""
+    if update_fields is not None and 'price' not in update_fields:
+        return
+    Product.objects.filter(pk=instance.pk).refresh_stock_summary()
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    """Обновляет запись товара в поисковом индексе"""
+    get_search_backend().index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def index_category_products(sender, instance, **kwargs):
+    """Название категории входит в индекс товаров этой категории"""
+    get_search_backend().index_category(instance.pk)
+
+
+@receiver(post_delete, sender=Category)
+def unindex_category(sender, instance, **kwargs):
+    get_search_backend().remove_category(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductSize)
+@receiver(post_delete, sender=ProductSize)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Size)
+@receiver(post_delete, sender=Size)
+@receiver(post_save, sender=ProductReview)
+@receiver(post_delete, sender=ProductReview)
+def invalidate_catalog(sender, using=None, **kwargs):
+    """Любое изменение каталога делает устаревшими его кэши (после фиксации)"""
+    bump_catalog_version_on_commit(using)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_query_cache(sender, using=None, **kwargs):
+    """
+    Сохранение или удаление объекта любой модели делает устаревшими
+    закэшированные запросы к ее таблице (см. shop/querycache.py)
+    """
+    invalidate_models(sender, using=using)
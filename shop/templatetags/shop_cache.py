@@ -0,0 +1,86 @@
+"""
+Кэш фрагментов шаблонов для списков объектов.
+
+    {% load shop_cache %}
+    {% cache_each "product_card" products as product product.category.updated_at %}
+        ... разметка карточки ...
+    {% endcache_each %}
+
+Тело блока рендерится отдельно для каждого объекта, результат
+кэшируется по имени фрагмента, id объекта и его ``updated_at``, так
+что изменение одного товара не сбрасывает карточки остальных. Значения
+после ``as переменная`` (как vary_on у тега ``cache``) вычисляются для
+каждого объекта и тоже входят в ключ - для данных, которые берутся не
+из самого объекта (название категории, число товаров). Объекты без
+``updated_at`` кэшируются до смены версии каталога (shop/cache.py).
+
+Все фрагменты страницы читаются одним ``get_many``, рендерятся только
+промахи, и они сохраняются одним ``set_many``. Тело блока не должно
+зависеть от посетителя (CSRF-токен, корзина).
+"""
+import hashlib
+
+from django import template
+from django.core.cache import cache
+
+from ..cache import get_catalog_version
+
+register = template.Library()
+
+
+def fragment_key(name, obj, vary_on=()):
+    updated_at = getattr(obj, 'updated_at', None)
+    stamp = updated_at.timestamp() if updated_at else f'v{get_catalog_version()}'
+    digest = hashlib.md5(repr(list(vary_on)).encode()).hexdigest() if vary_on else ''
+    return f'shop:fragment:{name}:{obj.pk}:{stamp}:{digest}'
+
+
+class CacheEachNode(template.Node):
+    def __init__(self, name, iterable, var_name, vary_on, nodelist):
+        self.name = name
+        self.iterable = iterable
+        self.var_name = var_name
+        self.vary_on = vary_on
+        self.nodelist = nodelist
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        objects = list(self.iterable.resolve(context) or [])
+        if not objects:
+            return ''
+
+        keys = []
+        for obj in objects:
+            with context.push(**{self.var_name: obj}):
+                keys.append(fragment_key(name, obj, [var.resolve(context) for var in self.vary_on]))
+        cached = cache.get_many(keys)
+
+        missing = {}
+        parts = []
+        for key, obj in zip(keys, objects):
+            if key not in cached:
+                with context.push(**{self.var_name: obj}):
+                    cached[key] = missing[key] = self.nodelist.render(context)
+            parts.append(cached[key])
+        if missing:
+            cache.set_many(missing)
+        return ''.join(parts)
+
+
+@register.tag
+def cache_each(parser, token):
+    """{% cache_each "имя" список as переменная [vary_on ...] %} ... {% endcache_each %}"""
+    bits = token.split_contents()
+    if len(bits) < 5 or bits[3] != 'as':
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' tag requires the form: {bits[0]} \"name\" iterable as var [vary_on ...]"
+        )
+    nodelist = parser.parse(('endcache_each',))
+    parser.delete_first_token()
+    return CacheEachNode(
+        parser.compile_filter(bits[1]),
+        parser.compile_filter(bits[2]),
+        bits[4],
+        [parser.compile_filter(bit) for bit in bits[5:]],
+        nodelist,
+    )
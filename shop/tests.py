@@ -1,3 +1,1435 @@
-from django.test import TestCase
+import io
+import os
+import re
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import patch
+from urllib.parse import urlsplit
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY as AUTH_SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore as DBSessionStore
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import OperationalError, connection
+from django.template import Context, Template
+from django.core.management import call_command
+from django.test import Client, LiveServerTestCase, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .cache import bump_catalog_version, get_catalog_version, get_or_recompute
+from .cart import Cart, resolve_lines
+from .mail import MAX_ATTEMPTS, drain, enqueue_mail
+from .models import Category, EmailOutbox, Order, OrderItem, Product, ProductSize, Size, StockReservation
+from .orders import OrderError, place_order
+from .page_cache import CSRF_INPUT_RE, degraded_stats, page_cache_key
+from .pagination import KeysetPaginator
+from .querycache import query_cache_stats
+from .reference import get_reference_data
+from .reservations import ReservationError, available_to_sell, reserve
+from .search import fuzzy_search_products, search_products
+from .search.suggest import suggest
+from .search.trigrams import text_trigrams, word_trigrams
+from .sessions import SessionStore, is_cookie_key, session_stats
+from .views import FUZZY_SEARCH_MIN_RESULTS
+
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'},
+}
+
+
+def save_session(client, session):
+    """Сохраняет сессию тестового клиента: у сессии в cookie меняется ключ"""
+    session.save()
+    client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StorefrontQueryCountTests(TestCase):
+    """Число запросов страниц каталога не зависит от количества карточек"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.size = Size.objects.create(code='M')
+        cls.categories = [
+            Category.objects.create(name=f'Категория {i}', slug=f'category-{i}')
+            for i in range(3)
+        ]
+        # Больше одной страницы и больше порога нечеткого поиска
+        cls.product = cls.create_products(13)[0]
+
+    @classmethod
+    def create_products(cls, count, start=0):
+        products = []
+        for i in range(start, start + count):
+            product = Product.objects.create(
+                name=f'Товар {i}',
+                slug=f'product-{i}',
+                description='Описание товара',
+                price=100 + i,
+                category=cls.categories[i % len(cls.categories)],
+                is_featured=True,
+            )
+            ProductSize.objects.create(product=product, size=cls.size, stock_quantity=5)
+            products.append(product)
+        return products
+
+    def setUp(self):
+        cache.clear()
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def assertConstantQueries(self, url):
+        few = self.count_queries(url)
+        self.create_products(20, start=100)
+        many = self.count_queries(url)
+        self.assertEqual(few, many)
+
+    def test_product_list(self):
+        self.assertConstantQueries(reverse('shop:product_list'))
+
+    def test_product_list_by_category(self):
+        self.assertConstantQueries(
+            reverse('shop:product_list_by_category', args=[self.categories[0].slug])
+        )
+
+    def test_search_results(self):
+        self.assertConstantQueries(reverse('shop:search_results') + '?q=Товар')
+
+    def test_featured_products(self):
+        self.assertConstantQueries(reverse('shop:featured_products'))
+
+    def test_new_arrivals(self):
+        self.assertConstantQueries(reverse('shop:new_arrivals'))
+
+    def test_product_detail_related(self):
+        self.assertConstantQueries(reverse('shop:product_detail', args=[self.product.slug]))
+
+    def test_storefront_defers_description(self):
+        product = Product.objects.storefront().get(pk=self.product.pk)
+        self.assertIn('description', product.get_deferred_fields())
+        with self.assertNumQueries(0):
+            self.assertEqual(product.category.name, self.product.category.name)
+
+    def test_storefront_excludes_out_of_stock(self):
+        ProductSize.objects.filter(product=self.product).update(in_stock=False)
+        self.assertFalse(Product.objects.storefront().filter(pk=self.product.pk).exists())
+        self.assertTrue(
+            Product.objects.storefront(in_stock=False).filter(pk=self.product.pk).exists()
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StockSummaryTests(TestCase):
+    """Сводка наличия и цен на товаре пересчитывается при каждом способе записи"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Категория', slug='category')
+        cls.sizes = [Size.objects.create(code=code) for code in ('S', 'M', 'L')]
+        cls.product = Product.objects.create(name='Товар', slug='product', price=100, category=cls.category)
+
+    def assertSummary(self, has_stock, total_stock, min_price, max_price, available_sizes_count):
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual(
+            (product.has_stock, product.total_stock, product.min_price, product.max_price,
+             product.available_sizes_count),
+            (has_stock, total_stock, Decimal(min_price), Decimal(max_price), available_sizes_count),
+        )
+
+    def create_size(self, size, **fields):
+        return ProductSize.objects.create(product=self.product, size=size, **fields)
+
+    def test_new_product_has_no_stock(self):
+        self.assertSummary(False, 0, 100, 100, 0)
+
+    def test_save_and_delete_of_size(self):
+        small = self.create_size(self.sizes[0], stock_quantity=3)
+        self.assertSummary(True, 3, 100, 100, 1)
+        large = self.create_size(self.sizes[2], stock_quantity=2, price=150)
+        self.assertSummary(True, 5, 100, 150, 2)
+
+        small.in_stock = False
+        small.save()
+        self.assertSummary(True, 5, 150, 150, 1)
+        large.delete()
+        self.assertSummary(False, 3, 100, 100, 0)
+
+    def test_queryset_update_of_sizes(self):
+        self.create_size(self.sizes[0], stock_quantity=3)
+        self.create_size(self.sizes[1], stock_quantity=1, price=80)
+        ProductSize.objects.filter(product=self.product).update(stock_quantity=0, in_stock=False)
+        self.assertSummary(False, 0, 100, 100, 0)
+
+    def test_bulk_create_and_bulk_update_of_sizes(self):
+        sizes = ProductSize.objects.bulk_create([
+            ProductSize(product=self.product, size=size, stock_quantity=2, price=price)
+            for size, price in zip(self.sizes, (90, None, 120))
+        ])
+        self.assertSummary(True, 6, 90, 120, 3)
+
+        sizes[0].price = 200
+        sizes[2].in_stock = False
+        ProductSize.objects.bulk_update(sizes, ['price', 'in_stock'])
+        self.assertSummary(True, 6, 100, 200, 2)
+
+    def test_base_price_change(self):
+        self.create_size(self.sizes[0], stock_quantity=1)
+        self.create_size(self.sizes[1], stock_quantity=1, price=150)
+        Product.objects.filter(pk=self.product.pk).update(price=120)
+        self.assertSummary(True, 2, 120, 150, 2)
+
+        product = Product.objects.get(pk=self.product.pk)
+        product.price = 160
+        product.save()
+        self.assertSummary(True, 2, 150, 160, 2)
+
+    def test_rebuild_command_repairs_drifted_summary(self):
+        self.create_size(self.sizes[0], stock_quantity=4, price=110)
+        # Запись в обход ORM-путей, которые поддерживают сводку
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {Product._meta.db_table} SET has_stock = %s, total_stock = 0, '
+                f'min_price = 1, max_price = 1, available_sizes_count = 0',
+                [False],
+            )
+        self.assertSummary(False, 0, 1, 1, 0)
+
+        out = io.StringIO()
+        call_command('rebuild_stock_summary', batch_size=1, stdout=out)
+        self.assertIn('1 товаров', out.getvalue())
+        self.assertSummary(True, 4, 110, 110, 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class KeysetPaginatorTests(TestCase):
+    """Курсорная пагинация: обход по курсорам совпадает с полной сортировкой"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Категория', slug='category')
+        for i in range(23):
+            # Повторяющиеся цены и популярность: порядок внутри равных задает id
+            Product.objects.create(
+                name=f'Товар {i:02d}', slug=f'product-{i}', price=100 + i % 4,
+                popularity=i % 3, category=category,
+            )
+        cls.factory = RequestFactory()
+
+    def get_page(self, ordering, **params):
+        paginator = KeysetPaginator(Product.objects.all(), 5, ordering=ordering)
+        return paginator.get_page(self.factory.get('/', params))
+
+    def walk(self, ordering):
+        """Все страницы по ссылкам «вперед»"""
+        pages = [self.get_page(ordering)]
+        while pages[-1].has_next():
+            pages.append(self.get_page(ordering, cursor=pages[-1].next_link['cursor']))
+        return pages
+
+    def test_cursor_round_trip_for_every_sort(self):
+        for ordering in (['name'], ['-name'], ['price'], ['-price'], ['created_at'], ['-popularity']):
+            with self.subTest(ordering=ordering):
+                pages = self.walk(ordering)
+                paginator = KeysetPaginator(Product.objects.all(), 5, ordering=ordering)
+                expected = list(Product.objects.order_by(*paginator.ordering).values_list('pk', flat=True))
+                self.assertEqual([p.pk for page in pages for p in page], expected)
+                self.assertEqual([page.number for page in pages], [1, 2, 3, 4, 5])
+
+    def test_back_link(self):
+        pages = self.walk(['price'])
+        back = pages[3].previous_link
+        self.assertEqual(back['number'], 3)
+        previous = self.get_page(['price'], cursor=back['cursor'])
+        self.assertEqual(list(previous), list(pages[2]))
+        self.assertIsNone(pages[1].previous_link['cursor'])  # первая страница - без курсора
+
+    def test_legacy_page_param(self):
+        pages = self.walk(['-price'])
+        legacy = self.get_page(['-price'], page='3')
+        self.assertEqual((legacy.number, list(legacy)), (3, list(pages[2])))
+        self.assertEqual(list(self.get_page(['-price'], page='99')), list(pages[0]))
+
+    def test_tampered_or_foreign_cursor_starts_from_first_page(self):
+        first, second = self.walk(['name'])[:2]
+        cursor = first.next_link['cursor']
+        self.assertEqual(list(self.get_page(['name'], cursor=cursor[:-2] + 'xx')), list(first))
+        # Курсор другой сортировки не подходит
+        self.assertEqual(list(self.get_page(['price'], cursor=cursor)), list(self.get_page(['price'])))
+        self.assertEqual(list(self.get_page(['name'], cursor=cursor)), list(second))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PopularityTests(TestCase):
+    """Популярность по продажам с затуханием и сортировка «популярные»"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Категория', slug='category')
+        cls.size = Size.objects.create(code='M')
+        cls.recent, cls.older, cls.unsold = [cls.create_product(i) for i in range(3)]
+
+    @classmethod
+    def create_product(cls, i, popularity=0):
+        product = Product.objects.create(
+            name=f'Товар {i}', slug=f'product-{i}', price=100, category=cls.category, popularity=popularity,
+        )
+        ProductSize.objects.create(product=product, size=cls.size, stock_quantity=5)
+        return product
+
+    def setUp(self):
+        cache.clear()
+
+    def sell(self, product, quantity, days_ago=0, status='new'):
+        order = Order.objects.create(
+            customer_name='Покупатель', customer_email='buyer@example.com',
+            customer_phone='+70000000000', customer_address='Адрес',
+            total_amount=100, status=status,
+        )
+        OrderItem.objects.create(
+            order=order, product=product, product_size=product.product_sizes.get(),
+            quantity=quantity, price=100,
+        )
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+
+    def update_popularity(self, **options):
+        call_command('update_popularity', stdout=io.StringIO(), **options)
+        return dict(Product.objects.values_list('pk', 'popularity'))
+
+    def test_sales_decay_with_age(self):
+        self.sell(self.recent, 4)
+        self.sell(self.older, 4, days_ago=14)
+        self.sell(self.older, 2, days_ago=28)
+        self.sell(self.unsold, 5, status='cancelled')
+        self.sell(self.unsold, 5, days_ago=200)
+        Product.objects.filter(pk=self.unsold.pk).update(popularity=7)
+
+        popularity = self.update_popularity(half_life_days=14)
+        self.assertAlmostEqual(popularity[self.recent.pk], 4)
+        self.assertAlmostEqual(popularity[self.older.pk], 4 * 0.5 + 2 * 0.25)
+        # Отмененные заказы и продажи вне окна не считаются, старое значение сбрасывается
+        self.assertEqual(popularity[self.unsold.pk], 0)
+
+    def test_repeated_runs_give_same_scores(self):
+        self.sell(self.recent, 3, days_ago=7)
+        first = self.update_popularity()
+        self.assertEqual(self.update_popularity(), first)
+        self.assertAlmostEqual(first[self.recent.pk], 3 * 0.5 ** 0.5)
+
+    def test_popular_sort_pages_through_ties(self):
+        for i in range(3, 20):
+            self.create_product(i, popularity=i % 3)
+        url = reverse('shop:product_list')
+        for order, expected in (
+            ('asc', Product.objects.order_by('-popularity', '-id')),
+            ('desc', Product.objects.order_by('popularity', 'id')),
+        ):
+            with self.subTest(order=order):
+                params, names = {'sort': 'popular', 'order': order}, []
+                while True:
+                    page = self.client.get(url, params).context['products']
+                    names.extend(product.name for product in page)
+                    if not page.has_next():
+                        break
+                    params['cursor'] = page.next_link['cursor']
+                self.assertEqual(names, [product.name for product in expected])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductSearchTests(TestCase):
+    """Полнотекстовый поиск: русская морфология, ранжирование, нечеткий поиск"""
+
+    @classmethod
+    def setUpTestData(cls):
+        size = Size.objects.create(code='M')
+        clothes = Category.objects.create(name='Одежда', slug='clothes')
+        cls.tshirt = cls.create_product('Футболка хлопковая', clothes, size)
+        cls.oversize = cls.create_product('Футболка оверсайз', clothes, size)
+        cls.jacket = cls.create_product('Куртка зимняя', clothes, size, description='Под куртку - футболку')
+        cls.boots = cls.create_product('Ботинки кожаные', clothes, size)
+
+    @staticmethod
+    def create_product(name, category, size, description=''):
+        product = Product.objects.create(
+            name=name, slug=f'product-{Product.objects.count()}', description=description,
+            price=1000, category=category,
+        )
+        ProductSize.objects.create(product=product, size=size, stock_quantity=5)
+        return product
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query):
+        return self.client.get(reverse('shop:search_results'), {'q': query}).context
+
+    def test_plural_query_matches_singular_by_stem(self):
+        found = search_products(Product.objects.all(), 'футболки').order_by('search_rank')
+        # Совпадение в названии выше совпадения в описании
+        self.assertEqual(list(found)[-1], self.jacket)
+        self.assertCountEqual(list(found)[:2], [self.tshirt, self.oversize])
+
+    def test_misspelled_query_falls_back_to_fuzzy_search(self):
+        self.assertFalse(search_products(Product.objects.all(), 'футблка').exists())
+        context = self.search('футблка')
+        self.assertTrue(context['is_fuzzy'])
+        self.assertEqual(context['results_count'], 2)
+        self.assertCountEqual(list(context['products']), [self.tshirt, self.oversize])
+
+    def test_no_fuzzy_search_with_enough_exact_results(self):
+        context = self.search('футболка')
+        self.assertGreaterEqual(context['results_count'], FUZZY_SEARCH_MIN_RESULTS)
+        self.assertFalse(context['is_fuzzy'])
+
+    def test_results_are_counted_without_count_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            context = self.search('футболка')
+        self.assertEqual(context['results_count'], 3)
+        self.assertFalse(context['results_count_capped'])
+        self.assertFalse([q for q in queries.captured_queries if '"__count"' in q['sql']])
+
+    def test_results_count_is_capped(self):
+        with patch('shop.views.SEARCH_COUNT_LIMIT', 2):
+            response = self.client.get(reverse('shop:search_results'), {'q': 'футболка'})
+        self.assertEqual(response.context['results_count'], 2)
+        self.assertContains(response, '<strong>2+</strong>')
+
+    def test_fuzzy_search_finds_products_of_similar_category(self):
+        found = fuzzy_search_products(Product.objects.all(), 'одежа')
+        self.assertEqual(found.count(), 4)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SearchSuggestTests(TestCase):
+    """Подсказки поиска из индекса в памяти и триграммы слов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Футболки', slug='tshirts')
+        for name, popularity in (('Футболка хлопковая', 1), ('Футболка оверсайз', 9), ('Куртка', 5)):
+            Product.objects.create(
+                name=name, slug=f'product-{popularity}', price=100,
+                category=cls.category, popularity=popularity,
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def names(self, query, limit=8):
+        return [item['name'] for item in suggest(query, limit)]
+
+    def test_prefix_matches_start_of_any_word(self):
+        self.assertEqual(self.names('хлоп'), ['Футболка хлопковая'])
+        self.assertEqual(self.names('КУРТ'), ['Куртка'])
+        self.assertEqual(self.names('футболка х'), ['Футболка хлопковая'])
+        self.assertEqual(self.names('олка'), [])
+        self.assertEqual(self.names('  '), [])
+
+    def test_categories_first_then_products_by_popularity(self):
+        expected = ['Футболки', 'Футболка оверсайз', 'Футболка хлопковая']
+        self.assertEqual(self.names('ф'), expected)  # заранее посчитанный короткий префикс
+        self.assertEqual(self.names('футб'), expected)
+        self.assertEqual(self.names('футб', limit=2), expected[:2])
+
+    def test_index_rebuilt_after_catalog_change(self):
+        self.assertEqual(self.names('плат'), [])
+        with self.assertNumQueries(0):
+            self.names('футб')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='Платье летнее', slug='dress', price=100, category=self.category)
+        self.assertEqual(self.names('плат'), ['Платье летнее'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(slug='dress').update(is_active=False)
+        self.assertEqual(self.names('плат'), [])
+
+    def test_suggest_view(self):
+        self.names('к')
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('shop:search_suggest'), {'q': 'курт', 'limit': 'x'})
+        self.assertEqual(response.json()['suggestions'], [
+            {'type': 'product', 'name': 'Куртка', 'url': reverse('shop:product_detail', args=['product-5'])},
+        ])
+
+    def test_word_trigrams(self):
+        self.assertEqual(word_trigrams('кот'), {'  к', ' ко', 'кот', 'от '})
+        self.assertEqual(
+            [number for number, _ in text_trigrams('Ёлка, зимняя!')], [0, 1]
+        )
+        self.assertIn('елк', text_trigrams('Ёлка')[0][1])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CartQueryCountTests(TestCase):
+    """Корзина и оформление заказа загружают все строки одним запросом"""
+
+    @classmethod
+    def setUpTestData(cls):
+        size = Size.objects.create(code='M')
+        category = Category.objects.create(name='Категория', slug='category')
+        cls.product_sizes = []
+        for i in range(50):
+            product = Product.objects.create(
+                name=f'Товар {i}', slug=f'product-{i}', price=100, category=category
+            )
+            cls.product_sizes.append(
+                ProductSize.objects.create(product=product, size=size, stock_quantity=5)
+            )
+
+    def fill_cart(self, product_sizes):
+        session = self.client.session
+        session['cart'] = {
+            'items': [
+                {
+                    'product_id': str(ps.product_id),
+                    'size_id': str(ps.pk),
+                    'quantity': 1,
+                    'price': '100.00',
+                    'product_name': ps.product.name,
+                    'size_name': 'M',
+                }
+                for ps in product_sizes
+            ],
+            'total': f'{100 * len(product_sizes)}.00',
+        }
+        save_session(self.client, session)
+
+    def count_queries(self, url, lines):
+        self.fill_cart(self.product_sizes[:lines])
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cart_items']), lines)
+        return len(context.captured_queries)
+
+    def test_cart_view(self):
+        url = reverse('shop:cart')
+        self.assertEqual(self.count_queries(url, 2), self.count_queries(url, 50))
+
+    def test_checkout(self):
+        url = reverse('shop:checkout')
+        self.assertEqual(self.count_queries(url, 2), self.count_queries(url, 50))
+
+    def test_missing_lines_are_pruned(self):
+        self.fill_cart(self.product_sizes[:3])
+        self.product_sizes[1].delete()
+        response = self.client.get(reverse('shop:cart'))
+        kept = [self.product_sizes[0].pk, self.product_sizes[2].pk]
+        self.assertEqual([line['line_id'] for line in response.context['cart_items']], kept)
+        cart = self.client.session['cart']
+        self.assertEqual(list(cart['lines']), [str(pk) for pk in kept])
+        self.assertEqual(cart['total'], 20000)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CartTests(TestCase):
+    """Строки корзины по id размера, суммы в копейках"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Категория', slug='category')
+        cls.product = Product.objects.create(name='Товар', slug='product', price='99.90', category=category)
+        cls.small = ProductSize.objects.create(
+            product=cls.product, size=Size.objects.create(code='S'), stock_quantity=10
+        )
+        cls.large = ProductSize.objects.create(
+            product=cls.product, size=Size.objects.create(code='L'), stock_quantity=10, price='120.05'
+        )
+
+    def test_total_is_kept_in_kopecks(self):
+        cart = Cart()
+        cart.add(self.small, 2)
+        cart.add(self.large, 1)
+        cart.add(self.small, 1)
+        self.assertEqual(len(cart), 2)
+        self.assertEqual(cart.total, 3 * 9990 + 12005)
+        cart.set_quantity(self.large.pk, 3)
+        cart.remove(self.small.pk)
+        self.assertEqual(cart.total_amount, Decimal('360.15'))
+        self.assertEqual(Cart(cart.to_session()).quantities(), {self.large.pk: 3})
+
+    def test_old_session_format_is_migrated(self):
+        cart = Cart({'items': [
+            {'product_id': str(self.product.pk), 'size_id': str(self.small.pk), 'quantity': 1, 'price': '99.90'},
+            {'product_id': str(self.product.pk), 'size_id': str(self.small.pk), 'quantity': 2, 'price': '99.90'},
+            {'product_id': str(self.product.pk), 'size_id': 'bad', 'quantity': 1, 'price': '1'},
+        ], 'total': '299.70'})
+        self.assertEqual(cart.quantities(), {self.small.pk: 3})
+        self.assertEqual(cart.total, 29970)
+
+    def test_line_urls_survive_removal(self):
+        for product_size in (self.small, self.large):
+            self.client.post(reverse('shop:add_to_cart'), {
+                'product_id': self.product.pk, 'size_id': product_size.pk, 'quantity': 1,
+            })
+        self.client.post(reverse('shop:remove_from_cart', args=[self.small.pk]))
+        self.client.post(reverse('shop:update_cart', args=[self.large.pk]), {'quantity': 4})
+
+        cart = self.client.session['cart']
+        self.assertEqual(cart['lines'], {str(self.large.pk): {
+            'p': self.product.pk, 'q': 4, 'u': 12005, 'n': 'Товар', 's': self.large.size.name,
+        }})
+        self.assertEqual(cart['total'], 4 * 12005)
+
+    def test_zero_quantity_adds_no_line(self):
+        cart = Cart()
+        self.assertIsNone(cart.add(self.small, 0))
+        self.assertFalse(cart)
+        self.assertFalse(cart.modified)
+
+    def test_non_positive_quantity_is_rejected(self):
+        for quantity in (0, -1):
+            with self.subTest(quantity=quantity):
+                response = self.client.post(reverse('shop:add_to_cart'), {
+                    'product_id': self.product.pk, 'size_id': self.small.pk, 'quantity': quantity,
+                }, follow=True)
+                self.assertRedirects(response, reverse('shop:product_detail', args=[self.product.slug]))
+                self.assertContains(response, 'Ошибка при добавлении в корзину')
+                self.assertNotIn('cart', self.client.session)
+                self.assertFalse(StockReservation.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CartApiTests(TestCase):
+    """JSON API корзины отвечает строкой и итогами одним запросом"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Категория', slug='category')
+        cls.product = Product.objects.create(name='Товар', slug='product', price=100, category=category)
+        cls.product_size = ProductSize.objects.create(
+            product=cls.product, size=Size.objects.create(code='M'), stock_quantity=3
+        )
+
+    def add(self, quantity):
+        return self.client.post(reverse('shop:cart_api_add'), {
+            'product_id': self.product.pk, 'size_id': self.product_size.pk, 'quantity': quantity,
+        })
+
+    def test_add_update_remove(self):
+        response = self.add(2)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['line']['line_id'], self.product_size.pk)
+        self.assertEqual(data['line']['total_price'], '200.00')
+        self.assertEqual((data['cart']['count'], data['cart']['total']), (1, '200.00'))
+
+        response = self.add(2)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['line']['quantity'], 2)
+
+        url = reverse('shop:cart_api_update', args=[self.product_size.pk])
+        self.assertEqual(self.client.post(url, {'quantity': 3}).json()['cart']['total'], '300.00')
+
+        response = self.client.post(reverse('shop:cart_api_remove', args=[self.product_size.pk]))
+        self.assertEqual(response.json(), {'line': None, 'cart': {'items': [], 'count': 0, 'total': '0.00'}})
+        self.assertEqual(self.client.get(reverse('shop:cart_api_summary')).json()['cart']['count'], 0)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get(reverse('shop:cart_api_add')).status_code, 405)
+        response = self.client.post(reverse('shop:cart_api_add'), {'product_id': 'x', 'size_id': ''})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+        response = self.client.post(reverse('shop:cart_api_update', args=[999]), {'quantity': 1})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StockReservationTests(TestCase):
+    """Товар в корзине отложен и не продается другим покупателям до истечения срока"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Категория', slug='category')
+        cls.product = Product.objects.create(name='Товар', slug='product', price=100, category=category)
+        cls.product_size = ProductSize.objects.create(
+            product=cls.product, size=Size.objects.create(code='M'), stock_quantity=3
+        )
+
+    def add(self, client, quantity):
+        return client.post(reverse('shop:cart_api_add'), {
+            'product_id': self.product.pk, 'size_id': self.product_size.pk, 'quantity': quantity,
+        })
+
+    def test_reserved_stock_is_not_sold_to_others(self):
+        first, second = Client(), Client()
+        self.assertEqual(self.add(first, 2).json()['available'], 3)
+
+        response = self.add(second, 2)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['available'], 1)
+        self.assertEqual(self.add(second, 1).status_code, 200)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(available_to_sell(self.product_size), 0)
+
+        first.post(reverse('shop:cart_api_remove', args=[self.product_size.pk]))
+        self.assertEqual(available_to_sell(self.product_size), 2)
+
+    def test_reserve_checks_stock_of_locked_row(self):
+        stale = ProductSize.objects.get(pk=self.product_size.pk)
+        ProductSize.objects.filter(pk=stale.pk).update(stock_quantity=1)
+        with self.assertRaises(ReservationError):
+            reserve(stale, 'holder', 2)
+        reserve(stale, 'holder', 1)
+        self.assertEqual(StockReservation.objects.get().quantity, 1)
+
+    def test_expired_reservations_are_released(self):
+        self.add(self.client, 3)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(available_to_sell(self.product_size), 3)
+
+        out = io.StringIO()
+        call_command('release_reservations', once=True, stdout=out)
+        self.assertIn('Снято резервов: 1', out.getvalue())
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_place_order_respects_and_releases_reservations(self):
+        own, other = Cart(), Cart()
+        own.add(self.product_size, 2)
+        reserve(self.product_size, own.ensure_holder(), 2)
+        reserve(self.product_size, other.ensure_holder(), 1)
+
+        order = Order(customer_name='Покупатель', customer_email='buyer@example.com',
+                      customer_phone='+70000000000', customer_address='Адрес')
+        place_order(order, own)
+        self.assertEqual(list(StockReservation.objects.values_list('holder', flat=True)), [other.holder])
+
+        own.set_quantity(self.product_size.pk, 1)
+        with self.assertRaises(OrderError):
+            place_order(Order(customer_name='Покупатель', customer_email='buyer@example.com',
+                              customer_phone='+70000000000', customer_address='Адрес'), own)
+
+    def test_pruned_cart_line_releases_reservation(self):
+        cart = Cart()
+        cart.add(self.product_size, 2)
+        reserve(self.product_size, cart.ensure_holder(), 2)
+        # Размер перенесен в другой товар: строка корзины больше не действительна
+        other = Product.objects.create(name='Другой товар', slug='other', price=100, category=self.product.category)
+        ProductSize.objects.filter(pk=self.product_size.pk).update(product=other)
+
+        lines, pruned = resolve_lines(cart)
+        self.assertEqual((lines, pruned), ([], True))
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(available_to_sell(self.product_size), 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SessionWriteTests(TestCase):
+    """Сессия сохраняется, только когда меняется содержимое корзины"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Категория', slug='category')
+        cls.product = Product.objects.create(name='Товар', slug='product', price=100, category=category)
+        cls.product_size = ProductSize.objects.create(
+            product=cls.product, size=Size.objects.create(code='M'), stock_quantity=5
+        )
+
+    def session_writes(self, *requests):
+        """Записи сессии: запросы к django_session и новые значения cookie сессии"""
+        writes = []
+        with CaptureQueriesContext(connection) as context:
+            for method, url, data in requests:
+                response = getattr(self.client, method)(url, data)
+                if settings.SESSION_COOKIE_NAME in response.cookies:
+                    writes.append(f'Set-Cookie {url}')
+        return writes + [
+            query['sql'] for query in context.captured_queries
+            if 'django_session' in query['sql'] and not query['sql'].startswith('SELECT')
+        ]
+
+    def test_read_only_cart_traffic_does_not_write_session(self):
+        add = ('post', reverse('shop:add_to_cart'), {
+            'product_id': self.product.pk, 'size_id': self.product_size.pk, 'quantity': 1,
+        })
+        self.assertTrue(self.session_writes(add))
+
+        cart_url = reverse('shop:cart')
+        update = ('post', reverse('shop:update_cart', args=[self.product_size.pk]), {'quantity': 1})
+        self.assertEqual(self.session_writes(
+            ('get', cart_url, {}), ('get', cart_url, {}),
+            ('get', reverse('shop:cart_state'), {}),
+            update,
+            ('get', cart_url, {}),
+        ), [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, SESSION_ENGINE='shop.sessions', SHOP_SESSION_COOKIE_MAX_SIZE=2048)
+class SessionEngineTests(TestCase):
+    """Маленькие сессии живут в cookie, большие и с входом - в базе"""
+
+    def test_small_session_is_kept_in_cookie(self):
+        session = SessionStore()
+        session['cart'] = {'v': 2, 'total': 100, 'lines': {'1': {'p': 1, 'q': 1, 'u': 100}}}
+        session.save()
+        self.assertTrue(is_cookie_key(session.session_key))
+        self.assertFalse(Session.objects.exists())
+        self.assertEqual(SessionStore(session.session_key)['cart']['total'], 100)
+
+    def test_session_moves_between_cookie_and_database(self):
+        session = SessionStore()
+        session['big'] = os.urandom(2048).hex()
+        session.save()
+        key = session.session_key
+        self.assertFalse(is_cookie_key(key))
+        self.assertTrue(Session.objects.filter(session_key=key).exists())
+
+        del session['big']
+        session.save()
+        self.assertTrue(is_cookie_key(session.session_key))
+        self.assertFalse(Session.objects.exists())
+
+        session[AUTH_SESSION_KEY] = '1'
+        session.save()
+        self.assertFalse(is_cookie_key(session.session_key))
+
+    def test_existing_database_session_is_read(self):
+        old = DBSessionStore()
+        old['cart'] = {'items': []}
+        old.create()
+        self.assertEqual(SessionStore(old.session_key)['cart'], {'items': []})
+
+    def test_anonymous_carts_do_not_grow_session_table(self):
+        category = Category.objects.create(name='Категория', slug='category')
+        product = Product.objects.create(name='Товар', slug='product', price=100, category=category)
+        product_size = ProductSize.objects.create(
+            product=product, size=Size.objects.create(code='M'), stock_quantity=5
+        )
+        before = session_stats()
+        for _ in range(3):
+            Client().post(reverse('shop:add_to_cart'), {
+                'product_id': product.pk, 'size_id': product_size.pk, 'quantity': 1,
+            })
+        self.assertEqual(Session.objects.count(), 0)
+        self.assertEqual(session_stats()['cookie_saves'] - before['cookie_saves'], 3)
+        self.assertEqual(session_stats()['db_saves'], before['db_saves'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PlaceOrderTests(TestCase):
+    """Оформление заказа списывает остатки и берет цены из базы"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Категория', slug='category')
+        cls.product = Product.objects.create(
+            name='Товар', slug='product', price=100, category=category
+        )
+        cls.small = ProductSize.objects.create(
+            product=cls.product, size=Size.objects.create(code='S'), stock_quantity=2
+        )
+        cls.large = ProductSize.objects.create(
+            product=cls.product, size=Size.objects.create(code='L'), stock_quantity=5, price=150
+        )
+
+    def make_order(self):
+        return Order(
+            customer_name='Покупатель',
+            customer_email='buyer@example.com',
+            customer_phone='+70000000000',
+            customer_address='Адрес',
+        )
+
+    def make_cart(self, *lines):
+        cart = Cart()
+        for product_size, quantity in lines:
+            cart.add(product_size, quantity)
+        return cart
+
+    def test_place_order(self):
+        order = place_order(self.make_order(), self.make_cart((self.small, 2), (self.large, 1)))
+
+        self.assertEqual(order.total_amount, 350)
+        self.assertEqual(order.items.count(), 2)
+        self.small.refresh_from_db()
+        self.large.refresh_from_db()
+        self.assertEqual((self.small.stock_quantity, self.small.in_stock), (0, False))
+        self.assertEqual((self.large.stock_quantity, self.large.in_stock), (4, True))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.popularity, 3)
+        self.assertEqual(self.product.total_stock, 4)
+
+    def test_insufficient_stock_saves_nothing(self):
+        with self.assertRaises(OrderError):
+            place_order(self.make_order(), self.make_cart((self.large, 1), (self.small, 3)))
+
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.large.refresh_from_db()
+        self.assertEqual(self.large.stock_quantity, 5)
+
+
+class FailingEmailBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionError('SMTP недоступен')
+
+
+class UnreachableEmailBackend(EmailBackend):
+    def open(self):
+        raise ConnectionRefusedError('соединение отклонено')
+
+
+class EmailOutboxTests(TestCase):
+    """Письма уходят из очереди, неудачные попытки повторяются позже"""
+
+    def test_drain_sends_queued_mail(self):
+        enqueue_mail('Тема 1', 'Текст', ['a@example.com'])
+        enqueue_mail('Тема 2', 'Текст', ['b@example.com'])
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(drain(batch_size=1), (2, 2))
+        self.assertEqual([m.subject for m in mail.outbox], ['Тема 1', 'Тема 2'])
+        self.assertFalse(EmailOutbox.objects.exclude(status='sent').exists())
+        self.assertEqual(drain(), (0, 0))
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        outbox = enqueue_mail('Тема', 'Текст', ['a@example.com'])
+
+        self.assertEqual(drain(connection=FailingEmailBackend()), (0, 1))
+        outbox.refresh_from_db()
+        self.assertEqual((outbox.status, outbox.attempts), ('pending', 1))
+        self.assertGreater(outbox.next_attempt_at, timezone.now())
+        self.assertIn('SMTP недоступен', outbox.last_error)
+        # Пауза еще не прошла
+        self.assertEqual(drain(), (0, 0))
+
+        EmailOutbox.objects.update(attempts=MAX_ATTEMPTS - 1, next_attempt_at=timezone.now())
+        drain(connection=FailingEmailBackend())
+        outbox.refresh_from_db()
+        self.assertEqual(outbox.status, 'failed')
+
+    def test_connection_failure_counts_as_attempt(self):
+        outbox = enqueue_mail('Тема', 'Текст', ['a@example.com'])
+
+        with self.assertRaises(ConnectionRefusedError):
+            drain(connection=UnreachableEmailBackend())
+        outbox.refresh_from_db()
+        self.assertEqual((outbox.status, outbox.attempts), ('pending', 1))
+        self.assertGreater(outbox.next_attempt_at, timezone.now())
+        self.assertIn('соединение отклонено', outbox.last_error)
+
+        EmailOutbox.objects.update(attempts=MAX_ATTEMPTS - 1, next_attempt_at=timezone.now())
+        with self.assertRaises(ConnectionRefusedError):
+            drain(connection=UnreachableEmailBackend())
+        outbox.refresh_from_db()
+        self.assertEqual(outbox.status, 'failed')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CatalogPageCacheTests(TestCase):
+    """Страницы каталога для анонимов берутся из кэша без запросов к базе"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Категория', slug='category')
+        cls.product = Product.objects.create(
+            name='Товар', slug='product', price=100, category=category
+        )
+        cls.product_size = ProductSize.objects.create(
+            product=cls.product, size=Size.objects.create(code='M'), stock_quantity=5
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_second_request_is_served_from_cache(self):
+        url = reverse('shop:product_list') + '?sort=price&utm_source=mail'
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('shop:product_list') + '?sort=price')
+        self.assertContains(response, 'Товар')
+
+    def test_catalog_change_invalidates_page(self):
+        url = reverse('shop:product_detail', args=[self.product.slug])
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(name='Новое название')
+        self.assertContains(self.client.get(url), 'Новое название')
+
+    def test_cart_and_csrf_are_not_shared(self):
+        url = reverse('shop:product_detail', args=[self.product.slug])
+        session = self.client.session
+        session['cart'] = {'items': [
+            {'product_id': '1', 'size_id': str(size_id), 'quantity': 1, 'price': '1'} for size_id in (1, 2)
+        ]}
+        save_session(self.client, session)
+        first = self.client.get(url)
+        self.assertEqual(self.client.get(reverse('shop:cart_state')).json()['count'], 2)
+
+        other = Client(enforce_csrf_checks=True)
+        second = other.get(url)
+        self.assertIsNone(second.context)  # страница из кэша, шаблон не рендерился
+        # Страницы посетителей отличаются только CSRF-токеном
+        self.assertEqual(
+            CSRF_INPUT_RE.sub('', first.content.decode()), CSRF_INPUT_RE.sub('', second.content.decode())
+        )
+        self.assertNotContains(second, 'shop-page-cache')
+        self.assertEqual(other.get(reverse('shop:cart_state')).json()['count'], 0)
+        # Форма добавления в корзину принимает токен нового посетителя
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', second.content.decode())
+        response = other.post(reverse('shop:add_to_cart'), {
+            'product_id': self.product.pk,
+            'size_id': self.product_size.pk,
+            'csrfmiddlewaretoken': token.group(1),
+        })
+        self.assertEqual(response.status_code, 302)
+
+    def test_stale_page_is_served_when_database_is_locked(self):
+        url = reverse('shop:product_list')
+        self.client.get(url)
+        bump_catalog_version()
+        before = degraded_stats()
+
+        def locked(execute, sql, params, many, context):
+            raise OperationalError('database is locked')
+
+        with connection.execute_wrapper(locked), self.assertLogs('shop.page_cache', 'WARNING'):
+            response = self.client.get(url)
+        self.assertContains(response, 'Товар')
+        self.assertEqual(response['X-Shop-Stale'], 'operational_error')
+        self.assertEqual(degraded_stats()['operational_error'], before['operational_error'] + 1)
+
+        # Копии нет - ошибка не скрывается
+        with connection.execute_wrapper(locked), self.assertRaises(OperationalError):
+            self.client.get(reverse('shop:new_arrivals'))
+
+    def test_page_rendered_before_commit_is_not_cached_as_new_version(self):
+        url = reverse('shop:product_detail', args=[self.product.slug])
+        self.client.get(url)
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductSize.objects.filter(pk=self.product_size.pk).update(stock_quantity=0)
+            Product.objects.filter(pk=self.product.pk).update(name='Новое название')
+            # Запись еще не зафиксирована: версия прежняя, чужой рендер
+            # получает прежнюю страницу и не сохраняет ничего под новой версией
+            self.assertEqual(get_catalog_version(), version)
+            Client().get(url)
+        self.assertNotEqual(get_catalog_version(), version)
+        self.assertContains(self.client.get(url), 'Новое название')
+
+    @override_settings(SHOP_DB_READ_BUDGET=0)
+    def test_stale_page_is_served_when_read_budget_is_exceeded(self):
+        url = reverse('shop:product_detail', args=[self.product.slug])
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(name='Новое название')
+        with self.assertLogs('shop.page_cache', 'WARNING'):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Shop-Stale'], 'read_budget')
+        self.assertContains(response, 'Товар')
+        self.assertTrue(response['ETag'].startswith('W/"stale-'))
+
+
+class CartStateTests(TestCase):
+    """Состояние корзины для скриптов страницы"""
+
+    def test_cart_state_revalidates_by_etag(self):
+        session = self.client.session
+        session['cart'] = {'items': [{'product_id': '1', 'size_id': '2', 'quantity': 1, 'price': '5.00'}], 'total': '5.00'}
+        save_session(self.client, session)
+
+        response = self.client.get(reverse('shop:cart_state'))
+        self.assertEqual(response.json()['total'], '5.00')
+        self.assertEqual(len(response.json()['items']), 1)
+        self.assertIn('private', response['Cache-Control'])
+
+        response = self.client.get(reverse('shop:cart_state'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CacheEachTagTests(TestCase):
+    """Фрагменты списков берутся из кэша до изменения самого объекта"""
+
+    template = Template(
+        '{% load shop_cache %}{% cache_each "card" products as product %}[{{ product.name }}]{% endcache_each %}'
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Категория', slug='category')
+        for i in range(3):
+            Product.objects.create(name=f'Товар {i}', slug=f'product-{i}', price=100, category=category)
+
+    def setUp(self):
+        cache.clear()
+
+    def render(self):
+        return self.template.render(Context({'products': list(Product.objects.order_by('pk'))}))
+
+    def test_fragments_are_reused_until_catalog_changes(self):
+        self.assertEqual(self.render(), '[Товар 0][Товар 1][Товар 2]')
+
+        products = list(Product.objects.order_by('pk'))
+        for product in products:
+            product.name = 'Не из кэша'
+        rendered = self.template.render(Context({'products': products}))
+        self.assertEqual(rendered, '[Товар 0][Товар 1][Товар 2]')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(name='Товар 1').update(name='Товар 1+')
+        self.assertEqual(self.render(), '[Товар 0][Товар 1+][Товар 2]')
+
+    def test_change_of_one_product_keeps_other_fragments(self):
+        template = Template(
+            '{% load shop_cache %}{% cache_each "card" products as product %}'
+            '[{{ product.name }}: {{ product.total_stock }}]{% endcache_each %}'
+        )
+        size = Size.objects.create(code='M')
+        first, second = Product.objects.order_by('pk')[:2]
+        ProductSize.objects.create(product=first, size=size, stock_quantity=5)
+        products = list(Product.objects.order_by('pk')[:2])
+        self.assertEqual(template.render(Context({'products': products})), '[Товар 0: 5][Товар 1: 0]')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductSize.objects.filter(product=first).update(stock_quantity=2)
+            bump_catalog_version()
+        # Популярность не меняет updated_at; карточка второго товара
+        # не рендерится заново и после смены версии каталога
+        Product.objects.filter(pk=second.pk).update(popularity=1)
+        products = list(Product.objects.order_by('pk')[:2])
+        products[1].name = 'Не из кэша'
+        self.assertEqual(
+            template.render(Context({'products': products})), '[Товар 0: 2][Товар 1: 0]'
+        )
+
+    def test_vary_on_values_are_part_of_key(self):
+        template = Template(
+            '{% load shop_cache %}{% cache_each "card" products as product product.category.name %}'
+            '[{{ product.category.name }}]{% endcache_each %}'
+        )
+        product = Product.objects.select_related('category').order_by('pk').first()
+        self.assertEqual(template.render(Context({'products': [product]})), '[Категория]')
+        product.category.name = 'Другая'
+        self.assertEqual(template.render(Context({'products': [product]})), '[Другая]')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ReferenceDataTests(TestCase):
+    """Справочники загружаются один раз на версию каталога"""
+
+    def setUp(self):
+        cache.clear()
+        parent = Category.objects.create(name='Одежда', slug='clothes')
+        self.child = Category.objects.create(name='Платья', slug='dresses', parent=parent)
+        Category.objects.create(name='Архив', slug='archive', is_active=False)
+        product = Product.objects.create(name='Товар', slug='product', price=100, category=self.child)
+        ProductSize.objects.create(product=product, size=Size.objects.create(code='M'))
+        Size.objects.create(code='L')
+
+    def test_reference_data(self):
+        data = get_reference_data()
+        with self.assertNumQueries(0):
+            data = get_reference_data()
+            self.assertEqual([c.slug for c in data.categories], ['clothes', 'dresses'])
+            self.assertEqual(data.get_category('dresses').parent.slug, 'clothes')
+            self.assertIsNone(data.get_category('archive'))
+            self.assertEqual([s.code for s in data.sizes_in_stock], ['M'])
+            self.assertEqual({s.code: s.name for s in data.sizes}['L'], 'Large')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductSize.objects.update(in_stock=False)
+        self.assertEqual(get_reference_data().sizes_in_stock, [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConditionalGetTests(TestCase):
+    """Неизменившиеся страницы каталога отдаются ответом 304"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Категория', slug='category')
+        cls.product = Product.objects.create(name='Товар', slug='product', price=100, category=category)
+        ProductSize.objects.create(product=cls.product, size=Size.objects.create(code='M'), stock_quantity=1)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_not_modified_until_catalog_changes(self):
+        url = reverse('shop:product_detail', args=[self.product.slug])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(name='Новое название')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_page_served_during_recompute_is_not_revalidated(self):
+        url = reverse('shop:product_detail', args=[self.product.slug])
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(name='Новое название')
+        cache.add(f'{page_cache_key(RequestFactory().get(url))}:lock', 1)  # пересчитывает другой процесс
+
+        response = self.client.get(url)
+        self.assertNotContains(response, 'Новое название')
+        self.assertTrue(response['ETag'].startswith('W/"stale-'))
+        self.assertIn('no-cache', response['Cache-Control'])
+        response = self.client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag'], HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_popularity_update_keeps_catalog_version(self):
+        url = reverse('shop:product_detail', args=[self.product.slug])
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.update(popularity=5)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductSize.objects.filter(product=self.product).update(stock_quantity=0)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_update_popularity_command_changes_etag(self):
+        url = reverse('shop:product_list')
+        etag = self.client.get(url)['ETag']
+        call_command('update_popularity', stdout=io.StringIO())
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_new_csrf_cookie_changes_etag(self):
+        url = reverse('shop:product_detail', args=[self.product.slug])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = 'x' * 32
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_authenticated_user_gets_no_validators(self):
+        url = reverse('shop:product_detail', args=[self.product.slug])
+        etag = self.client.get(url)['ETag']
+        User = get_user_model()
+        self.client.force_login(User.objects.create_user('buyer', password='x'))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_sitemap_if_modified_since(self):
+        url = reverse('shop:django.contrib.sitemaps.views.sitemap')
+        response = self.client.get(url)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GetOrRecomputeTests(TestCase):
+    """Устаревшее значение пересчитывает один процесс, остальные отдают старое"""
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_recompute_on_version_change(self):
+        self.assertEqual(get_or_recompute('key', self.compute, 60, version=1), (1, 1))
+        self.assertEqual(get_or_recompute('key', self.compute, 60, version=1), (1, 1))
+        self.assertEqual(get_or_recompute('key', self.compute, 60, version=2), (2, 2))
+
+    def test_stale_value_is_served_while_locked(self):
+        get_or_recompute('key', self.compute, 60, version=1)
+        cache.add('key:lock', 1)  # пересчитывает другой процесс
+        self.assertEqual(get_or_recompute('key', self.compute, 60, version=2), (1, 1))
+        self.assertEqual(self.calls, 1)
+
+    def test_expired_value_is_recomputed(self):
+        get_or_recompute('key', self.compute, 0, version=1)
+        self.assertEqual(get_or_recompute('key', self.compute, 60, version=1), (2, 1))
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'shop.tiered_cache.TieredCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {'MAX_ENTRIES': 2, 'VERSION_KEYS': ['version'], 'VERSION_CHECK_INTERVAL': 0},
+    },
+    'shared': LOCMEM_CACHES['default'],
+})
+class TieredCacheTests(TestCase):
+    """Локальный уровень отвечает на горячие ключи и сбрасывается по версии"""
+
+    def setUp(self):
+        from django.core.cache import caches
+
+        self.cache, self.shared = caches['default'], caches['shared']
+        self.cache.clear()
+        self.cache.stats.update(local_hits=0, shared_hits=0, misses=0)
+
+    def test_tiers_and_counters(self):
+        self.shared.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.stats, {'local_hits': 1, 'shared_hits': 1, 'misses': 1})
+
+    def test_lru_is_bounded(self):
+        for key in 'abc':
+            self.cache.set(key, key)
+        self.shared.delete('a')
+        self.shared.delete('c')
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('c'), 'c')
+
+    def test_version_change_in_other_process_clears_local_tier(self):
+        self.cache.set('version', 1)
+        self.cache.set('page', 'old')
+        self.assertEqual(self.cache.get('page'), 'old')
+
+        # Другой процесс меняет версию и страницу прямо в общем кэше
+        self.shared.incr('version')
+        self.shared.set('page', 'new')
+        self.assertEqual(self.cache.get('page'), 'new')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class WarmCacheCommandTests(LiveServerTestCase):
+    """warm_cache заполняет кэш страниц запросами к сайту по адресам из лога и sitemap"""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Категория', slug='category')
+        self.product = Product.objects.create(name='Товар', slug='product', price=100, category=category)
+        ProductSize.objects.create(product=self.product, size=Size.objects.create(code='M'), stock_quantity=1)
+
+    def warm_cache(self, **options):
+        out = io.StringIO()
+        call_command('warm_cache', stdout=out, stderr=io.StringIO(), **options)
+        return out.getvalue()
+
+    def assertCached(self, url):
+        host = urlsplit(self.live_server_url).netloc
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_HOST=host).status_code, 200)
+
+    def test_warm_cache(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as log:
+            line = '1.2.3.4 - - [17/Oct/2026:10:00:00 +0000] "GET {} HTTP/1.1" {} 512 "-" "UA"\n'
+            log.write(line.format('/?sort=price&utm_source=vk', 200) * 3)
+            log.write(line.format('/cart/', 200))
+            log.write(line.format('/?sort=name', 404))
+
+        output = self.warm_cache(base_url=self.live_server_url, access_log=log.name, concurrency=2)
+        os.unlink(log.name)
+
+        # Из sitemap - только страницы с кэшем: главная, категория и товар
+        self.assertIn('Прогрето страниц: 4, с ошибками: 0', output)
+        self.assertCached('/?sort=price')
+        self.assertCached(reverse('shop:product_detail', args=[self.product.slug]))
+
+    def test_base_url_defaults_to_site_url(self):
+        with self.settings(SITE_URL=self.live_server_url):
+            self.warm_cache()
+        self.assertCached(reverse('shop:product_detail', args=[self.product.slug]))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class QueryCacheTests(TestCase):
+    """.cached() отдает результат из кэша до изменения таблиц запроса"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Категория', slug='category')
+        cls.product = Product.objects.create(name='Товар', slug='product', price=100, category=cls.category)
+
+    def setUp(self):
+        cache.clear()
+
+    def products(self):
+        return list(Product.objects.select_related('category').filter(is_active=True).cached())
+
+    def test_repeated_query_hits_cache(self):
+        before = query_cache_stats()
+        self.assertEqual(self.products(), [self.product])
+        with self.assertNumQueries(0):
+            cached = self.products()
+        self.assertEqual(cached[0].category.name, 'Категория')
+        self.assertEqual(Product.objects.cached().count(), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(Product.objects.cached().count(), 1)
+
+        stats = query_cache_stats()
+        self.assertEqual(stats['hits'] - before['hits'], 2)
+        self.assertEqual(stats['misses'] - before['misses'], 2)
+
+    def test_save_invalidates_joined_table(self):
+        self.products()
+        self.category.name = 'Новая категория'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.products()[0].category.name, 'Новая категория')
+
+    def test_bulk_operations_invalidate(self):
+        self.products()
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(is_active=False)
+        self.assertEqual(self.products(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.bulk_create([
+                Product(name='Второй', slug='second', price=50, category=self.category),
+            ])
+        self.assertEqual(len(self.products()), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(slug='second').delete()
+        self.assertEqual(self.products(), [])
+
+    def test_save_of_non_catalog_model_invalidates(self):
+        size = ProductSize.objects.create(product=self.product, size=Size.objects.create(code='M'))
+
+        def reserved():
+            return list(
+                ProductSize.objects.filter(reservations__isnull=False).values_list('pk', flat=True).cached()
+            )
+
+        self.assertEqual(reserved(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            StockReservation.objects.create(
+                product_size=size, holder='holder', quantity=1, expires_at=timezone.now()
+            )
+        self.assertEqual(reserved(), [size.pk])
+
+    def test_tables_are_invalidated_after_commit(self):
+        self.products()
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(is_active=False)
+            # До фиксации чтение в другом соединении видит прежние строки:
+            # они остаются под прежней версией таблицы
+            with self.assertNumQueries(0):
+                self.assertEqual(self.products(), [self.product])
+        self.assertEqual(self.products(), [])
+
+    def test_uncached_queryset_always_queries(self):
+        list(Product.objects.all())
+        with self.assertNumQueries(1):
+            list(Product.objects.all())
@@ -0,0 +1,225 @@
+"""
+Двухуровневый кэш: LRU в памяти процесса перед общим бэкендом.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'shop.tiered_cache.TieredCache',
+            'LOCATION': 'shared',            # алиас общего кэша
+            'OPTIONS': {
+                'MAX_ENTRIES': 1000,         # размер LRU процесса
+                'LOCAL_TIMEOUT': 5,          # сколько секунд верить локальной копии
+                'VERSION_KEYS': ['shop:catalog_version'],
+                'VERSION_CHECK_INTERVAL': 1,
+            },
+        },
+        'shared': {...},
+    }
+
+Чтение идет сначала из памяти процесса, затем из общего кэша. Запись
+идет в оба уровня. Ключи версий (``VERSION_KEYS``) перечитываются из
+общего кэша не реже раза в ``VERSION_CHECK_INTERVAL`` секунд. Если
+версия сменилась в другом процессе, локальный уровень очищается, и
+инвалидация расходится по всем процессам за эту секунду. Прочие ключи,
+измененные другими процессами, устаревают не дольше ``LOCAL_TIMEOUT``.
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+_missing = object()
+
+# Локальный уровень общий для всех потоков процесса (как у LocMemCache):
+# экземпляры бэкенда Django создает на каждый поток
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+
+class _LocalTier:
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.versions = None
+        self.versions_checked_at = 0.0
+        self.stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = location
+        self._max_entries = int(options.get('MAX_ENTRIES', 1000))
+        self._local_timeout = float(options.get('LOCAL_TIMEOUT', 5))
+        self._version_keys = list(options.get('VERSION_KEYS', []))
+        self._version_check_interval = float(options.get('VERSION_CHECK_INTERVAL', 1))
+
+        with _tiers_lock:
+            self._tier = _tiers.setdefault(location, _LocalTier())
+        self._local = self._tier.entries
+        self._lock = self._tier.lock
+
+    @property
+    def stats(self):
+        """Счетчики попаданий по уровням (на процесс)"""
+        return self._tier.stats
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    # --- Локальный уровень ---
+
+    def _local_key(self, key, version):
+        return self.shared.make_key(key, version=version)
+
+    def _local_get(self, local_key):
+        with self._lock:
+            entry = self._local.get(local_key)
+            if entry is None:
+                return _missing
+            pickled, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._local[local_key]
+                return _missing
+            self._local.move_to_end(local_key)
+        return pickle.loads(pickled)
+
+    def _local_set(self, local_key, value, timeout=None):
+        # Значение хранится сериализованным, как в LocMemCache: изменение
+        # полученного объекта не меняет копию в кэше
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        ttl = self._local_timeout if timeout is None else timeout
+        with self._lock:
+            self._local[local_key] = (pickled, time.monotonic() + ttl)
+            self._local.move_to_end(local_key)
+            while len(self._local) > self._max_entries:
+                self._local.popitem(last=False)
+
+    def _local_delete(self, local_key):
+        with self._lock:
+            self._local.pop(local_key, None)
+
+    def _local_clear(self):
+        with self._lock:
+            self._local.clear()
+
+    def _local_timeout_for(self, timeout):
+        """Локальная копия не живет дольше, чем запись в общем кэше"""
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            return self._local_timeout
+        return max(min(self._local_timeout, timeout - time.time()), 0)
+
+    def _check_versions(self):
+        """Сбрасывает локальный уровень, если ключи версий изменились в общем кэше"""
+        if not self._version_keys:
+            return
+        tier = self._tier
+        now = time.monotonic()
+        if now - tier.versions_checked_at < self._version_check_interval:
+            return
+        versions = self.shared.get_many(self._version_keys)
+        if tier.versions is not None and versions != tier.versions:
+            self._local_clear()
+        tier.versions = versions
+        tier.versions_checked_at = now
+        for key, value in versions.items():
+            self._local_set(self._local_key(key, None), value, self._version_check_interval)
+
+    # --- Интерфейс BaseCache ---
+
+    def get(self, key, default=None, version=None):
+        self._check_versions()
+        local_key = self._local_key(key, version)
+        value = self._local_get(local_key)
+        if value is not _missing:
+            self.stats['local_hits'] += 1
+            return value
+        value = self.shared.get(key, _missing, version=version)
+        if value is _missing:
+            self.stats['misses'] += 1
+            return default
+        self.stats['shared_hits'] += 1
+        self._local_set(local_key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        self._check_versions()
+        found, remote = {}, []
+        for key in keys:
+            value = self._local_get(self._local_key(key, version))
+            if value is _missing:
+                remote.append(key)
+            else:
+                found[key] = value
+        self.stats['local_hits'] += len(found)
+        if remote:
+            shared = self.shared.get_many(remote, version=version)
+            self.stats['shared_hits'] += len(shared)
+            self.stats['misses'] += len(remote) - len(shared)
+            for key, value in shared.items():
+                self._local_set(self._local_key(key, version), value)
+            found.update(shared)
+        return found
+
+    def has_key(self, key, version=None):
+        return self.get(key, _missing, version=version) is not _missing
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout=timeout, version=version)
+        self._local_set(self._local_key(key, version), value, self._local_timeout_for(timeout))
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout=timeout, version=version)
+        local_timeout = self._local_timeout_for(timeout)
+        for key, value in data.items():
+            if key not in failed:
+                self._local_set(self._local_key(key, version), value, local_timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # Решает общий кэш: на add построены блокировки между процессами
+        added = self.shared.add(key, value, timeout=timeout, version=version)
+        local_key = self._local_key(key, version)
+        if added:
+            self._local_set(local_key, value, self._local_timeout_for(timeout))
+        else:
+            self._local_delete(local_key)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout=timeout, version=version)
+
+    def delete(self, key, version=None):
+        self._local_delete(self._local_key(key, version))
+        return self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._local_delete(self._local_key(key, version))
+        self.shared.delete_many(keys, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version=version)
+        if key in self._version_keys:
+            # Версия сменилась в этом процессе: локальные копии устарели сразу
+            self._local_clear()
+            self._tier.versions_checked_at = 0.0
+        else:
+            self._local_delete(self._local_key(key, version))
+        return value
+
+    def decr(self, key, delta=1, version=None):
+        return self.incr(key, -delta, version=version)
+
+    def clear(self):
+        self._local_clear()
+        self._tier.versions = None
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
@@ -4,6 +4,7 @@ from django.contrib.sitemaps.views import sitemap
 from django.contrib.sitemaps import Sitemap
 from .models import Product, Category
 from . import views
+from .page_cache import catalog_conditional, catalog_page_cache
 from django.views.generic.base import TemplateView
 
 app_name = 'shop'
@@ -57,12 +58,18 @@ urlpatterns = [
     path('category/<slug:category_slug>/', views.product_list, name='product_list_by_category'),
     path('product/<slug:product_slug>/', views.product_detail, name='product_detail'),
     path('search/', views.search_results, name='search_results'),
+    path('search/suggest/', views.search_suggest, name='search_suggest'),
     path('featured/', views.featured_products, name='featured_products'),
     path('new/', views.new_arrivals, name='new_arrivals'),
     path('add-to-cart/', views.add_to_cart, name='add_to_cart'),
     path('cart/', views.cart_view, name='cart'),
-    path('cart/update/<int:item_index>/', views.update_cart, name='update_cart'),
-    path('cart/remove/<int:item_index>/', views.remove_from_cart, name='remove_from_cart'),
+    path('cart/state/', views.cart_state, name='cart_state'),
+    path('cart/api/', views.cart_api_summary, name='cart_api_summary'),
+    path('cart/api/add/', views.cart_api_add, name='cart_api_add'),
+    path('cart/api/lines/<int:line_id>/', views.cart_api_update, name='cart_api_update'),
+    path('cart/api/lines/<int:line_id>/remove/', views.cart_api_remove, name='cart_api_remove'),
+    path('cart/update/<int:line_id>/', views.update_cart, name='update_cart'),
+    path('cart/remove/<int:line_id>/', views.remove_from_cart, name='remove_from_cart'),
     path('cart/clear/', views.clear_cart, name='clear_cart'),
     path('checkout/', views.checkout, name='checkout'),
     path('order/success/<int:order_id>/', views.order_success, name='order_success'),
@@ -74,7 +81,7 @@ urlpatterns = [
     path('contacts/', views.contacts, name='contacts'),
     path('about/', views.about, name='about'),
     path('payment/', views.payment_info, name='payment_info'),
-    path('sitemap.xml', sitemap, {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap'),
+    path('sitemap.xml', catalog_conditional(catalog_page_cache(sitemap)), {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap'),
     path('robots.txt', TemplateView.as_view(
         template_name='robots.txt', 
         content_type='text/plain'
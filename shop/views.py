@@ -1,94 +1,79 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import Q, Exists, OuterRef, Sum
+from django.http import Http404, JsonResponse
 from django.utils.translation import gettext_lazy as _
 from django.contrib import messages
-from decimal import Decimal
-from django.core.mail import send_mail
+from django.db import transaction
 from django.conf import settings
 from django.utils import timezone
 from django.utils.dateformat import format
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_GET, require_POST
+from .cart import get_cart, resolve_lines, save_cart, serialize_cart, serialize_line
 from .forms import OrderForm
-from .models import Order, OrderItem
-from .models import Product, Category, ProductSize, Size
+from .mail import enqueue_mail
+from .models import Order
+from .models import Product, ProductSize
+from .orders import OrderError, place_order
+from .page_cache import catalog_conditional, catalog_page_cache
+from .pagination import KeysetPaginator
+from .reference import get_reference_data
+from .reservations import ReservationError, available_to_sell, release, reserve, reserved_quantities
+from .search import fuzzy_search_products, search_products
+from .search.suggest import MAX_SUGGESTIONS, suggest
+import hashlib
+import json
 import pytz
 
 # ... остальные импорты и функции ...
 
-def get_cart(request):
-    """Получение корзины из сессии"""
-    cart = request.session.get('cart', {})
-    if 'items' not in cart:
-        cart['items'] = []
-    if 'total' not in cart:
-        cart['total'] = Decimal('0.00')
-    return cart
-
-def save_cart(request, cart):
-    """Сохранение корзины в сессии"""
-    request.session['cart'] = cart
-    request.session.modified = True
-
-def update_cart_total(cart):
-    """Обновление общей суммы корзины"""
-    total = Decimal('0.00')
-    for item in cart['items']:
-        total += Decimal(item['price']) * item['quantity']
-    cart['total'] = str(total)  # Сохраняем как строку для сессии
+def cart_stock_error(product_size, quantity):
+    """Почему нельзя положить ``quantity`` штук размера в корзину (или None)"""
+    if not product_size.in_stock:
+        return 'Этот размер временно отсутствует'
+    if quantity > product_size.stock_quantity:
+        return 'Недостаточно товара на складе'
+    return None
+
+def reserve_cart_line(cart, product_size, quantity):
+    """
+    Проверяет наличие и резервирует за корзиной ``quantity`` штук размера
+    (всего по строке). Возвращает текст ошибки или None.
+    """
+    error = cart_stock_error(product_size, quantity)
+    if error:
+        return error
+    try:
+        reserve(product_size, cart.ensure_holder(), quantity)
+    except ReservationError as e:
+        return str(e)
+    return None
 
 def add_to_cart(request):
     """
     Добавление товара в корзину
     """
     if request.method == 'POST':
+        product = get_object_or_404(Product, id=_to_int(request.POST.get('product_id')))
         try:
-            product_id = request.POST.get('product_id')
             size_id = request.POST.get('size_id')
             quantity = int(request.POST.get('quantity', 1))
+            if quantity < 1:
+                raise ValueError(quantity)
             
-            product = get_object_or_404(Product, id=product_id)
             product_size = get_object_or_404(ProductSize, id=size_id, product=product)
             
-            # Проверяем наличие
-            if not product_size.in_stock:
-                messages.error(request, 'Этот размер временно отсутствует')
-                return redirect('shop:product_detail', product_slug=product.slug)
-            
-            if quantity > product_size.stock_quantity:
-                messages.error(request, 'Недостаточно товара на складе')
-                return redirect('shop:product_detail', product_slug=product.slug)
-            
-            # Получаем корзину из сессии
+            # Строка корзины ищется по id размера, сумма пересчитывается на месте
             cart = get_cart(request)
+            line = cart.get(product_size.pk)
             
-            # Проверяем, есть ли уже такой товар в корзине
-            item_index = None
-            for i, item in enumerate(cart['items']):
-                if item['product_id'] == product_id and item['size_id'] == size_id:
-                    item_index = i
-                    break
-            
-            final_price = product_size.get_final_price()
-            
-            if item_index is not None:
-                # Обновляем количество существующего товара
-                cart['items'][item_index]['quantity'] += quantity
-            else:
-                # Добавляем новый товар в корзину
-                cart['items'].append({
-                    'product_id': product_id,
-                    'size_id': size_id,
-                    'quantity': quantity,
-                    'price': str(final_price),
-                    'product_name': product.name,
-                    'size_name': product_size.size.name,
-                    'image_url': product.image.url if product.image else ''
-                })
-            
-            # Обновляем общую сумму
-            update_cart_total(cart)
+            # Проверяем наличие и откладываем товар за корзиной
+            error = reserve_cart_line(cart, product_size, quantity + (line['q'] if line else 0))
+            if error:
+                messages.error(request, error)
+                return redirect('shop:product_detail', product_slug=product.slug)
             
-            # Сохраняем корзину в сессии
+            cart.add(product_size, quantity, product.name, product_size.size.name)
             save_cart(request, cart)
             
             messages.success(request, f'Товар "{product.name}" ({product_size.size.name}) добавлен в корзину!')
@@ -100,45 +85,138 @@ def add_to_cart(request):
     
     return redirect('shop:product_list')
 
+def cart_state(request):
+    """
+    Состояние корзины (JSON) для скриптов страницы. Ответ кэшируется
+    браузером и перепроверяется по ETag, сама страница от корзины не зависит.
+    """
+    state = serialize_cart(get_cart(request))
+    etag = quote_etag(hashlib.md5(json.dumps(state, sort_keys=True).encode()).hexdigest())
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(state)
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+def _cart_api_response(cart, line_id=None, status=200, error=None, product_size=None):
+    """
+    Ответ API корзины: строка (если осталась в корзине), состояние корзины
+    и, для изменяемого размера, сколько штук доступно этой корзине
+    """
+    line = cart.get(line_id) if line_id is not None else None
+    data = {
+        'line': serialize_line(line_id, line) if line is not None else None,
+        'cart': serialize_cart(cart),
+    }
+    if product_size is not None:
+        data['available'] = available_to_sell(product_size, cart.holder)
+    if error:
+        data['error'] = error
+    return JsonResponse(data, status=status)
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+@require_GET
+def cart_api_summary(request):
+    """
+    API корзины: состояние корзины
+    """
+    return _cart_api_response(get_cart(request))
+
+@require_POST
+def cart_api_add(request):
+    """
+    API корзины: добавление товара. Отвечает строкой и итогами корзины
+    вместо перенаправления на страницу товара.
+    """
+    cart = get_cart(request)
+    quantity = _to_int(request.POST.get('quantity', 1))
+    product_size = ProductSize.objects.select_related('product', 'size').filter(
+        id=_to_int(request.POST.get('size_id')),
+        product_id=_to_int(request.POST.get('product_id')),
+    ).first()
+    if product_size is None or quantity is None or quantity < 1:
+        return _cart_api_response(cart, status=400, error='Ошибка при добавлении в корзину')
+
+    line = cart.get(product_size.pk)
+    error = reserve_cart_line(cart, product_size, quantity + (line['q'] if line else 0))
+    if error:
+        return _cart_api_response(cart, product_size.pk, status=409, error=error, product_size=product_size)
+
+    cart.add(product_size, quantity, product_size.product.name, product_size.size.name)
+    save_cart(request, cart)
+    return _cart_api_response(cart, product_size.pk, product_size=product_size)
+
+@require_POST
+def cart_api_update(request, line_id):
+    """
+    API корзины: новое количество строки (0 - удалить строку)
+    """
+    cart = get_cart(request)
+    line = cart.get(line_id)
+    quantity = _to_int(request.POST.get('quantity', 1))
+    if line is None or quantity is None or quantity < 0:
+        return _cart_api_response(cart, line_id, status=400, error='Ошибка при обновлении корзины')
+
+    if quantity == 0:
+        cart.remove(line_id)
+        release(cart.holder, line_id)
+    else:
+        product_size = ProductSize.objects.filter(id=line_id, product_id=line['p']).first()
+        if product_size is None:
+            cart.remove(line_id)
+            save_cart(request, cart)
+            return _cart_api_response(cart, line_id, status=409, error='Товар больше не продается')
+        error = reserve_cart_line(cart, product_size, quantity)
+        if error:
+            return _cart_api_response(cart, line_id, status=409, error=error, product_size=product_size)
+        cart.set_quantity(line_id, quantity)
+    save_cart(request, cart)
+    return _cart_api_response(cart, line_id)
+
+@require_POST
+def cart_api_remove(request, line_id):
+    """
+    API корзины: удаление строки
+    """
+    cart = get_cart(request)
+    cart.remove(line_id)
+    release(cart.holder, line_id)
+    save_cart(request, cart)
+    return _cart_api_response(cart, line_id)
+
 def cart_view(request):
     """
     Представление для отображения корзины покупок
     """
     cart = get_cart(request)
     
-    # Получаем полную информацию о товарах в корзине
-    cart_items = []
-    for item in cart['items']:
-        try:
-            product = Product.objects.get(id=item['product_id'])
-            product_size = ProductSize.objects.get(id=item['size_id'], product=product)
-            
-            cart_items.append({
-                'index': cart['items'].index(item),
-                'product': product,
-                'product_size': product_size,
-                'quantity': item['quantity'],
-                'total_price': Decimal(item['price']) * item['quantity'],
-                'image_url': item.get('image_url', '')
-            })
-        except (Product.DoesNotExist, ProductSize.DoesNotExist):
-            # Удаляем несуществующий товар из корзины
-            cart['items'].remove(item)
-    
-    # Обновляем корзину после проверки
-    update_cart_total(cart)
-    save_cart(request, cart)
+    # Все товары корзины одним запросом; несуществующие удаляются из корзины
+    cart_items, pruned = resolve_lines(cart)
+    if pruned:
+        save_cart(request, cart)
+    
+    # Доступно к заказу: остаток без резервов других корзин (один запрос)
+    reserved = reserved_quantities([item['line_id'] for item in cart_items], exclude_holder=cart.holder)
+    for item in cart_items:
+        item['available'] = max(item['product_size'].stock_quantity - reserved.get(item['line_id'], 0), 0)
     
     context = {
         'page_title': 'Корзина покупок',
         'cart_items': cart_items,
-        'cart_total': Decimal(cart['total']),
-        'cart_count': len(cart['items'])
+        'cart_total': cart.total_amount,
+        'cart_count': len(cart)
     }
     
     return render(request, 'shop/cart.html', context)
 
-def update_cart(request, item_index):
+def update_cart(request, line_id):
     """
     Обновление количества товара в корзине
     """
@@ -146,57 +224,48 @@ def update_cart(request, item_index):
         cart = get_cart(request)
         
         try:
-            item_index = int(item_index)
-            if 0 <= item_index < len(cart['items']):
+            line = cart.get(line_id)
+            if line is not None:
                 new_quantity = int(request.POST.get('quantity', 1))
                 
                 if new_quantity > 0:
                     # Проверяем наличие на складе
-                    item = cart['items'][item_index]
-                    product_size = ProductSize.objects.get(
-                        id=item['size_id'], 
-                        product_id=item['product_id']
-                    )
+                    product_size = ProductSize.objects.get(id=line_id, product_id=line['p'])
                     
-                    if new_quantity > product_size.stock_quantity:
-                        messages.error(request, 'Недостаточно товара на складе')
+                    error = reserve_cart_line(cart, product_size, new_quantity)
+                    if error:
+                        messages.error(request, error)
                     else:
-                        cart['items'][item_index]['quantity'] = new_quantity
-                        update_cart_total(cart)
+                        cart.set_quantity(line_id, new_quantity)
                         save_cart(request, cart)
                         messages.success(request, 'Количество товара обновлено')
                 else:
                     # Удаляем товар если количество = 0
-                    return remove_from_cart(request, item_index)
+                    return remove_from_cart(request, line_id)
                     
-        except (ValueError, IndexError, ProductSize.DoesNotExist):
+        except (ValueError, ProductSize.DoesNotExist):
             messages.error(request, 'Ошибка при обновлении корзины')
     
     return redirect('shop:cart')
 
-def remove_from_cart(request, item_index):
+def remove_from_cart(request, line_id):
     """
     Удаление товара из корзины
     """
     cart = get_cart(request)
-    
-    try:
-        item_index = int(item_index)
-        if 0 <= item_index < len(cart['items']):
-            removed_item = cart['items'].pop(item_index)
-            update_cart_total(cart)
-            save_cart(request, cart)
-            
-            # Получаем информацию о товаре для сообщения
-            try:
-                product = Product.objects.get(id=removed_item['product_id'])
-                product_size = ProductSize.objects.get(id=removed_item['size_id'])
-                messages.success(request, f'Товар "{product.name}" ({product_size.size.name}) удален из корзины')
-            except (Product.DoesNotExist, ProductSize.DoesNotExist):
-                messages.success(request, 'Товар удален из корзины')
-                
-    except (ValueError, IndexError):
-        messages.error(request, 'Ошибка при удалении товара')
+    removed_line = cart.remove(line_id)
+    if removed_line is not None:
+        release(cart.holder, line_id)
+        save_cart(request, cart)
+        
+        # Название и размер сохранены в строке корзины
+        if removed_line.get('n'):
+            messages.success(
+                request,
+                f'Товар "{removed_line["n"]}" ({removed_line.get("s", "")}) удален из корзины'
+            )
+        else:
+            messages.success(request, 'Товар удален из корзины')
     
     return redirect('shop:cart')
 
@@ -206,8 +275,11 @@ def checkout(request):
     Оформление заказа
     """
     cart = get_cart(request)
+    cart_items, pruned = resolve_lines(cart)
+    if pruned:
+        save_cart(request, cart)
     
-    if not cart['items']:
+    if not cart:
         messages.error(request, 'Корзина пуста')
         return redirect('shop:cart')
     
@@ -218,64 +290,34 @@ def checkout(request):
             if not form.cleaned_data.get('agree_to_terms'):
                 messages.error(request, 'Вы должны согласиться с условиями перед оформлением заказа')
             else:
+                order = form.save(commit=False)
+                order.agreed_to_terms = True  # сохраняем согласие
                 try:
-                    # Создаем заказ
-                    order = form.save(commit=False)
-                    order.total_amount = Decimal(cart['total'])
-                    order.agreed_to_terms = True  # сохраняем согласие
-                    order.save()
-                    
-                    # Создаем товары в заказе
-                    for item in cart['items']:
-                        product = Product.objects.get(id=item['product_id'])
-                        product_size = ProductSize.objects.get(id=item['size_id'])
-                        
-                        OrderItem.objects.create(
-                            order=order,
-                            product=product,
-                            product_size=product_size,
-                            quantity=item['quantity'],
-                            price=Decimal(item['price'])
-                        )
-                    
-                    # Отправляем email администратору
-                    send_order_notification(order)
-                    
+                    # Заказ, товары, списание остатков и письмо администратору
+                    # сохраняются одной транзакцией
+                    with transaction.atomic():
+                        place_order(order, cart)
+                        send_order_notification(order)
+                except OrderError as e:
+                    messages.error(request, str(e))
+                except Exception as e:
+                    messages.error(request, f'Ошибка при оформлении заказа: {str(e)}')
+                else:
                     # Очищаем корзину
                     clear_cart(request)
                     
                     messages.success(request, f'Заказ #{order.order_number} успешно оформлен!')
                     return redirect('shop:order_success', order_id=order.id)
-                    
-                except Exception as e:
-                    messages.error(request, f'Ошибка при оформлении заказа: {str(e)}')
         else:
             # Если форма невалидна, показываем ошибки
             messages.error(request, 'Пожалуйста, исправьте ошибки в форме')
     else:
         form = OrderForm()
     
-    # Получаем информацию о товарах для отображения
-    cart_items = []
-    for item in cart['items']:
-        try:
-            product = Product.objects.get(id=item['product_id'])
-            product_size = ProductSize.objects.get(id=item['size_id'])
-            
-            cart_items.append({
-                'product': product,
-                'product_size': product_size,
-                'quantity': item['quantity'],
-                'price': Decimal(item['price']),
-                'total': Decimal(item['price']) * item['quantity']
-            })
-        except (Product.DoesNotExist, ProductSize.DoesNotExist):
-            continue
-    
     context = {
         'form': form,
         'cart_items': cart_items,
-        'cart_total': Decimal(cart['total']),
+        'cart_total': cart.total_amount,
         'page_title': 'Оформление заказа'
     }
     
@@ -296,7 +338,7 @@ def order_success(request, order_id):
 
 def send_order_notification(order):
     """
-    Отправка уведомления администратору о новом заказе
+    Уведомление администратору о новом заказе (ставится в очередь писем)
     """
     
      # ПРИНУДИТЕЛЬНАЯ конвертация в московское время
@@ -341,25 +383,15 @@ def send_order_notification(order):
     Состав заказа:
     """
     
-    for item in order.items.all():
+    for item in order.items.select_related('product', 'product_size__size'):
         message += f"\n- {item.product.name} ({item.product_size.size.name})"
         message += f" - {item.quantity} шт. x {item.price} ₽ = {item.total_price} ₽"
     
     message += f"\n\nОбщая сумма: {order.total_amount} ₽"
     message += f"\n\nСсылка на заказ в админке: http://127.0.0.1:8000/admin/shop/order/{order.id}/"
     
-    # Отправляем email администратору
-    try:
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [settings.ADMIN_EMAIL],  # Email администратора
-            fail_silently=False,
-        )
-    except Exception as e:
-        # Логируем ошибку, но не прерываем выполнение
-        print(f"Ошибка отправки email: {e}")
+    # Письмо отправит run_mail_worker, заказ не ждет SMTP-сервер
+    enqueue_mail(subject, message, [settings.ADMIN_EMAIL])  # Email администратора
 
 
 def clear_cart(request):
@@ -367,34 +399,28 @@ def clear_cart(request):
     Очистка корзины
     """
     cart = get_cart(request)
-    cart['items'] = []
-    cart['total'] = '0.00'
+    cart.clear()
+    release(cart.holder)
     save_cart(request, cart)
     messages.success(request, 'Корзина очищена')
     return redirect('shop:cart')
 
 
+@catalog_conditional
+@catalog_page_cache
 def product_list(request, category_slug=None):
     """
     Представление для отображения списка всех товаров или товаров по категории
     """
-    # Создаем подзапрос для проверки наличия товара
-    in_stock_subquery = ProductSize.objects.filter(
-        product=OuterRef('pk'),
-        in_stock=True
-    )
-    
     # Получаем все активные товары, у которых есть хотя бы один размер в наличии
-    products = Product.objects.filter(
-        is_active=True
-    ).annotate(
-        has_stock=Exists(in_stock_subquery)
-    ).filter(has_stock=True)
+    products = Product.objects.storefront()
     
     # Если передан slug категории, фильтруем товары по категории
     category = None
     if category_slug:
-        category = get_object_or_404(Category, slug=category_slug, is_active=True)
+        category = get_reference_data().get_category(category_slug)
+        if category is None:
+            raise Http404('Категория не найдена')
         products = products.filter(category=category)
     
     # Получаем параметры фильтрации из GET-запроса
@@ -426,47 +452,33 @@ def product_list(request, category_slug=None):
             pass
     
     if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) |
-            Q(description__icontains=search_query) |
-            Q(category__name__icontains=search_query)
-        )
+        products = search_products(products, search_query)
     
-    # Сортировка
-    sort_by = request.GET.get('sort', 'name')
+    # Сортировка (при поиске без явной сортировки - по релевантности)
+    sort_by = request.GET.get('sort', 'relevance' if search_query else 'name')
     order = request.GET.get('order', 'asc')
     
     sort_fields = {
         'name': 'name',
         'price': 'price',
         'created': 'created_at',
-        'popular': '?',
+        'popular': '-popularity',
     }
+    if search_query:
+        sort_fields['relevance'] = 'search_rank'
     
-    if sort_by in sort_fields:
-        field = sort_fields[sort_by]
-        if order == 'desc':
-            field = f'-{field}'
-        products = products.order_by(field)
-    
-    # Пагинация
-    paginator = Paginator(products, 12)
-    page = request.GET.get('page')
-    
-    try:
-        products_page = paginator.page(page)
-    except PageNotAnInteger:
-        products_page = paginator.page(1)
-    except EmptyPage:
-        products_page = paginator.page(paginator.num_pages)
+    field = sort_fields.get(sort_by, 'name')
+    if order == 'desc':
+        field = field[1:] if field.startswith('-') else f'-{field}'
     
-    # Получаем все активные категории для меню
-    categories = Category.objects.filter(is_active=True)
+    # Пагинация по ключу сортировки (без COUNT(*) и OFFSET)
+    paginator = KeysetPaginator(products, 12, ordering=[field])
+    products_page = paginator.get_page(request)
     
-    # Уникальные размеры для фильтра (только те, что есть в наличии)
-    available_sizes = Size.objects.filter(
-        product_sizes__in_stock=True
-    ).distinct()
+    # Категории для меню и размеры в наличии для фильтра - из справочника в памяти
+    reference = get_reference_data()
+    categories = reference.categories
+    available_sizes = reference.sizes_in_stock
     
     # Тексты для сортировки
     sort_options = {
@@ -475,6 +487,8 @@ def product_list(request, category_slug=None):
         'created': _('По дате добавления'),
         'popular': _('По популярности'),
     }
+    if search_query:
+        sort_options['relevance'] = _('По релевантности')
     
     order_options = {
         'asc': _('По возрастанию'),
@@ -500,38 +514,31 @@ def product_list(request, category_slug=None):
     return render(request, 'shop/product_list.html', context)
 
 
+@catalog_conditional
+@catalog_page_cache
 def product_detail(request, product_slug):
     """
     Представление для отображения детальной страницы товара
     """
     product = get_object_or_404(
-        Product, 
+        Product.objects.select_related('category'),
         slug=product_slug, 
         is_active=True
     )
     
     # Получаем ВСЕ размеры товара (и в наличии, и нет)
-    all_sizes = product.product_sizes.all().select_related('size').order_by('size__code')
+    all_sizes = product.product_sizes.select_related('size').order_by('size__code').cached()
     
     # Получаем изображения товара
-    product_images = product.images.all()
-    
-    # Создаем подзапрос для проверки наличия связанных товаров
-    in_stock_subquery = ProductSize.objects.filter(
-        product=OuterRef('pk'),
-        in_stock=True
-    )
+    product_images = product.images.cached()
     
     # Получаем связанные товары (из той же категории) которые есть в наличии
-    related_products = Product.objects.filter(
-        category=product.category,
-        is_active=True
-    ).annotate(
-        has_stock=Exists(in_stock_subquery)
-    ).filter(has_stock=True).exclude(id=product.id)[:4]
+    related_products = Product.objects.storefront().filter(
+        category=product.category
+    ).exclude(id=product.id).cached()[:4]
     
-    # Получаем одобренные отзывы
-    reviews = product.reviews.filter(is_approved=True)
+    # Получаем одобренные отзывы (из кэша запросов до изменения отзывов)
+    reviews = product.reviews.filter(is_approved=True).cached()
     
     # Средний рейтинг
     from django.db.models import Avg
@@ -553,7 +560,7 @@ def category_list(request):
     """
     Представление для отображения списка всех категорий
     """
-    categories = Category.objects.filter(is_active=True)
+    categories = get_reference_data().categories
     
     context = {
         'categories': categories,
@@ -563,67 +570,85 @@ def category_list(request):
     return render(request, 'shop/category_list.html', context)
 
 
+# Если точный поиск нашел меньше товаров, подключается нечеткий
+FUZZY_SEARCH_MIN_RESULTS = 3
+
+# Найденные товары считаются до этого предела, больше - «100+»
+SEARCH_COUNT_LIMIT = 100
+
+
+def _count_up_to(queryset, limit):
+    """Число строк выборки, но не больше limit + 1 (без COUNT по всей выборке)"""
+    return len(queryset.order_by().values_list('pk', flat=True)[:limit + 1])
+
+
 def search_results(request):
     """
     Представление для отображения результатов поиска
     """
-    # Создаем подзапрос для проверки наличия товара
-    in_stock_subquery = ProductSize.objects.filter(
-        product=OuterRef('pk'),
-        in_stock=True
-    )
-    
     query = request.GET.get('q')
-    products = Product.objects.filter(
-        is_active=True
-    ).annotate(
-        has_stock=Exists(in_stock_subquery)
-    ).filter(has_stock=True)
+    products = Product.objects.storefront()
     
+    ordering = ['-created_at']
+    is_fuzzy = False
+    results_count, results_count_capped = None, False
     if query:
-        products = products.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query) |
-            Q(category__name__icontains=query)
-        )
-    
-    # Пагинация
-    paginator = Paginator(products, 12)
-    page = request.GET.get('page')
-    
-    try:
-        products_page = paginator.page(page)
-    except PageNotAnInteger:
-        products_page = paginator.page(1)
-    except EmptyPage:
-        products_page = paginator.page(paginator.num_pages)
+        # Полнотекстовый поиск, результаты по релевантности
+        found = search_products(products, query)
+        results_count = _count_up_to(found, SEARCH_COUNT_LIMIT)
+        ordering = ['search_rank']
+        
+        # Мало точных совпадений - пробуем нечеткий поиск (опечатки)
+        if results_count < FUZZY_SEARCH_MIN_RESULTS:
+            fuzzy = fuzzy_search_products(products, query)
+            fuzzy_count = _count_up_to(fuzzy, SEARCH_COUNT_LIMIT)
+            if fuzzy_count > results_count:
+                found, results_count, is_fuzzy = fuzzy, fuzzy_count, True
+        products = found
+        if results_count > SEARCH_COUNT_LIMIT:
+            results_count, results_count_capped = SEARCH_COUNT_LIMIT, True
+    
+    # Пагинация по ключу сортировки (без COUNT(*) и OFFSET)
+    paginator = KeysetPaginator(products, 12, ordering=ordering)
+    products_page = paginator.get_page(request)
     
     context = {
         'products': products_page,
         'search_query': query,
-        'results_count': products.count(),
+        'results_count': results_count,
+        'results_count_capped': results_count_capped,
+        'is_fuzzy': is_fuzzy,
+        'categories': get_reference_data().categories,
         'page_title': _('Результаты поиска'),
     }
     
     return render(request, 'shop/search_results.html', context)
 
 
+def search_suggest(request):
+    """
+    Подсказки для строки поиска (JSON). Отвечает из индекса в памяти
+    процесса и не обращается к базе данных.
+    """
+    query = request.GET.get('q', '')
+    try:
+        limit = min(max(int(request.GET.get('limit', 8)), 1), MAX_SUGGESTIONS)
+    except ValueError:
+        limit = 8
+    
+    return JsonResponse({
+        'query': query,
+        'suggestions': suggest(query, limit),
+    })
+
+
+@catalog_conditional
+@catalog_page_cache
 def featured_products(request):
     """
     Представление для отображения рекомендуемых товаров
     """
-    # Создаем подзапрос для проверки наличия товара
-    in_stock_subquery = ProductSize.objects.filter(
-        product=OuterRef('pk'),
-        in_stock=True
-    )
-    
-    products = Product.objects.filter(
-        is_active=True,
-        is_featured=True
-    ).annotate(
-        has_stock=Exists(in_stock_subquery)
-    ).filter(has_stock=True)
+    products = Product.objects.storefront().filter(is_featured=True)
     
     context = {
         'products': products,
@@ -634,32 +659,23 @@ def featured_products(request):
     return render(request, 'shop/featured_products.html', context)
 
 
+@catalog_conditional
+@catalog_page_cache
 def new_arrivals(request):
     """
     Представление для отображения новых поступлений
     """
-    from datetime import datetime, timedelta
+    from datetime import timedelta
     
     # Товары, добавленные за последние 30 дней
-    thirty_days_ago = datetime.now() - timedelta(days=30)
+    thirty_days_ago = timezone.now() - timedelta(days=30)
     
-    # Получаем все новые товары (без фильтра по наличию размеров)
-    products = Product.objects.filter(
-        is_active=True,
+    # Получаем все новые товары (без фильтра по наличию размеров).
+    # has_stock, available_sizes_count и total_stock хранятся в самом товаре
+    products = Product.objects.storefront(in_stock=False).filter(
         updated_at__gte=thirty_days_ago
     ).order_by('-updated_at')
     
-    # Добавляем информацию о наличии для каждого товара
-    for product in products:
-        # Проверяем, есть ли у товара размеры в наличии
-        available_sizes = product.product_sizes.filter(in_stock=True)
-        product.has_stock = available_sizes.exists()
-        product.available_sizes_count = available_sizes.count()
-        
-        # Получаем общее количество на складе (используем Sum из django.db.models)
-        total_stock = product.product_sizes.aggregate(total=Sum('stock_quantity'))['total'] or 0
-        product.total_stock = total_stock
-    
     context = {
         'products': products,
         'title': _('Новые поступления'),
@@ -770,13 +786,7 @@ def contacts(request):
                 Дата: {timezone.now().strftime("%d.%m.%Y %H:%M")}
                 """
                 
-                send_mail(
-                    subject,
-                    message_body,
-                    settings.DEFAULT_FROM_EMAIL,
-                    [settings.ADMIN_EMAIL],  # Email администратора
-                    fail_silently=False,
-                )
+                enqueue_mail(subject, message_body, [settings.ADMIN_EMAIL])  # Email администратора
                 
                 # Отправка подтверждения пользователю
                 user_subject = 'Ваше сообщение получено'
@@ -794,13 +804,7 @@ def contacts(request):
                 Команда NEBOLEY
                 """
                 
-                send_mail(
-                    user_subject,
-                    user_message,
-                    settings.DEFAULT_FROM_EMAIL,
-                    [email],
-                    fail_silently=False,
-                )
+                enqueue_mail(user_subject, user_message, [email])
                 
                 messages.success(request, '✅ Ваше сообщение успешно отправлено! Мы ответим вам в ближайшее время.')
                 return redirect('shop:contacts')